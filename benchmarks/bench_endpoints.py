@@ -0,0 +1,42 @@
+"""
+Microbenchmark of the per-call overhead of building backend request URLs and headers.
+
+Compares building them on each call, as done before the endpoint table, with
+looking them up in the compiled table. Run with `python benchmarks/bench_endpoints.py`.
+"""
+import timeit
+from urllib.parse import urljoin
+
+from flask_taler.endpoints import compile_endpoints
+
+BASE_URL = 'https://merchant.taler.example.com'
+API_KEY = 'secret-token:sandbox'
+NUMBER = 200_000
+
+endpoints = compile_endpoints(BASE_URL, API_KEY)
+
+
+def per_call(order_id):
+    url = urljoin(BASE_URL, f'/private/orders/{order_id}/refund')
+    headers = {
+        'Accept': 'application/json',
+        'Authorization': f'Basic {API_KEY}',
+    }
+    headers['Content-Type'] = 'application/json'
+    return url, headers
+
+
+def compiled(order_id):
+    endpoint = endpoints['process_refund']
+    return endpoint.url(order_id), endpoint.headers
+
+
+def main():
+    assert per_call('o1') == (compiled('o1')[0], dict(compiled('o1')[1]))
+    for name, func in (('per call', per_call), ('endpoint table', compiled)):
+        best = min(timeit.repeat(lambda: func('order-42'), number=NUMBER, repeat=5))
+        print(f'{name:>16}: {best / NUMBER * 1e9:8.0f} ns/call')
+
+
+if __name__ == '__main__':
+    main()
@@ -16,18 +16,14 @@ taler = Taler(app)
 def buy_product(product_id):
     product = get_product_from_db(product_id)  # Replace with your product lookup logic
 
-    order = taler.create_order(
+    order_id, payment_url = taler.create_checkout(
         amount=product.price,
         order_id=f"prod-{product_id}",
         product_description=product.name,
         fulfillment_url=url_for('payment_success', product_id=product_id, _external=True)
     )
 
-    payment_url = taler.get_payment_url(order['order_id'])
-    if payment_url:
-        return redirect(payment_url)
-    else:
-        return "Error creating order or getting payment URL."
+    return redirect(payment_url)
 
 
 # Example route to handle successful payment callback
@@ -1,31 +1,36 @@
 from flask import current_app, g, request, abort
 import requests
-from urllib.parse import urljoin
+from urllib.parse import quote, urlsplit
 import hmac
 import hashlib
 import logging
-import json
-
-# Configure logging
+import queue
+import time
+import asyncio
+import os
+import random
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from .amount import Amount
+from .batch import BatchResult, Checkpoint, TokenBucket, iter_concurrent
+from .cache import OrderCache
+from .codec import get_codec
+from .dedup import dedup_store_from_config, event_key
+from .endpoints import backend_root, compile_endpoints
+from .log import TruncatedRepr, configure_logging
+from .models import Order
+from .metrics import DEFAULT_BUCKETS, Metrics, metrics_blueprint
+from .mirror import OrderMirror
+from .outbox import Outbox
+from .singleflight import AsyncSingleFlight, SingleFlight
+from .tracing import NoopTracer, tracer_from_config
+from .transport import CircuitBreaker, CircuitOpenError, Transport, raise_for_status
+from .webhooks import HandlerRegistry, WorkerPool, queue_from_config
+
+# Handlers are attached by init_app (see `configure_logging`), not at import time
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)  # Set the logging level to INFO
-
-# Create a file handler
-file_handler = logging.FileHandler('flask_taler.log')
-file_handler.setLevel(logging.INFO)
-
-# Create a console handler (optional, for console output)
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-
-# Create a formatter and set it for both handlers
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
-
-# Add the handlers to the logger
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
 
 class Taler(object):
     """
@@ -34,8 +39,6 @@ class Taler(object):
 
     def __init__(self, app=None):
         self.app = app
-        if app is not None:
-            self.init_app(app)
 
         # Configuration parameters (defaults can be set here)
         self.exchange_url = None
@@ -43,15 +46,104 @@ class Taler(object):
         self.merchant_api_key = None
         self.default_currency = "EUR"
         self.webhook_secret = None  # Add a secret for webhook verification
+        self.transport = None  # Pooled HTTP transport, built by init_app
+        self.endpoints = None  # Compiled backend endpoints by operation, built by init_app
+        self.codec = get_codec()  # JSON encoding and decoding of backend calls and webhooks
+        self.order_cache = None  # Optional cache of get_order results
+        self.order_mirror = None  # Optional local database of orders, for reporting
+        self.refund_rate = None  # Maximum number of refunds per second started by process_refunds
+        self.outbox = None  # Optional durable log of calls sent in the background
+        self.metrics = None  # Metrics of the backend calls
+        self.tracer = NoopTracer()  # Tracing hooks around backend calls and webhook dispatch
+        self.webhook_queue = None  # Queue of webhooks to process in the background, in async mode
+        self.webhook_workers = None
+        self.webhook_handlers = HandlerRegistry()  # Registered with the `on` decorator
+        self.webhook_dedup = None  # Optional store of processed deliveries, to drop duplicates
+        self.webhook_log_sample_rate = 1.0  # Fraction of webhook payloads written to the log
+        self.webhook_log_max_size = 1024  # Maximum size of a logged webhook payload
+
+        # Concurrent lookups of the same order share a single backend request
+        self._order_flights = SingleFlight()
+        self._async_order_flights = AsyncSingleFlight()
+
+        if app is not None:
+            self.init_app(app)
 
     def init_app(self, app):
         """Initialize the extension with the Flask app."""
+        # Webhook workers run the handlers in an app context of their own
+        self.app = app
+
         # Load configuration from Flask app's config
         self.exchange_url = app.config['TALER_EXCHANGE_URL']
         self.merchant_backend_url = app.config['TALER_MERCHANT_BACKEND_URL']
         self.merchant_api_key = app.config['TALER_MERCHANT_API_KEY']
-        self.default_currency = app.config.get('TALER_DEFAULT_CURRENCY')
+        self.default_currency = app.config.get('TALER_DEFAULT_CURRENCY', 'EUR')
         self.webhook_secret = app.config.get('TALER_WEBHOOK_SECRET')  # Webhook secret
+        self.refund_rate = app.config.get('TALER_REFUND_RATE')
+
+        # Log records are written to the configured sinks by a background thread
+        configure_logging(app)
+        self.webhook_log_sample_rate = app.config.get('TALER_WEBHOOK_LOG_SAMPLE_RATE', 1.0)
+        self.webhook_log_max_size = app.config.get('TALER_WEBHOOK_LOG_MAX_SIZE', 1024)
+
+        # orjson or ujson when installed, unless configured otherwise
+        self.codec = get_codec(app.config.get('TALER_JSON_BACKEND'))
+
+        # URLs and headers of the backend calls are built once, not on each call
+        self.endpoints = compile_endpoints(self.merchant_backend_url, self.merchant_api_key)
+
+        # One connection pool shared by all methods and worker threads
+        self.transport = Transport.from_config(app.config)
+
+        # Fail fast while the backend is down
+        if app.config.get('TALER_CIRCUIT_BREAKER', True):
+            self.transport.breaker = CircuitBreaker.from_config(app.config)
+
+        # Optional tracing, with the trace context propagated to the backend
+        self.tracer = tracer_from_config(app.config)
+        self.transport.tracer = self.tracer
+
+        # Backend call metrics, optionally served in the Prometheus format
+        if app.config.get('TALER_METRICS', True):
+            self.metrics = Metrics(app.config.get('TALER_METRICS_BUCKETS', DEFAULT_BUCKETS))
+            self.transport.metrics = self.metrics
+            if self.transport.breaker is not None:
+                self.metrics.set_gauge('taler_circuit_breaker_state', self.transport.breaker.state_value,
+                                       'Merchant backend circuit breaker state (0: closed, 1: half-open, 2: open).')
+            if app.config.get('TALER_METRICS_URL'):
+                app.register_blueprint(metrics_blueprint(self.metrics, app.config['TALER_METRICS_URL']))
+
+        # Opt-in cache of order details, invalidated by webhooks and refunds
+        if app.config.get('TALER_ORDER_CACHE', False):
+            self.order_cache = OrderCache.from_config(app.config)
+
+        # Opt-in local mirror of the orders, updated by sync_orders and webhooks
+        if app.config.get('TALER_ORDER_MIRROR'):
+            self.order_mirror = OrderMirror(os.path.join(app.instance_path, app.config['TALER_ORDER_MIRROR']),
+                                            self.codec)
+            if app.config.get('TALER_ORDER_MIRROR_SYNC_INTERVAL'):
+                self.order_mirror.start(self, app.config['TALER_ORDER_MIRROR_SYNC_INTERVAL'])
+
+        # Opt-in outbox, for calls which do not need a synchronous answer
+        if app.config.get('TALER_OUTBOX'):
+            self.outbox = Outbox.from_config(os.path.join(app.instance_path, app.config['TALER_OUTBOX']),
+                                             self.codec, app.config)
+            if app.config.get('TALER_OUTBOX_WORKER', True):
+                self.outbox.start(self._send_outbox_entry)
+
+        self.webhook_handlers.parallel = app.config.get('TALER_WEBHOOK_PARALLEL_HANDLERS', False)
+        self.webhook_handlers.slow_threshold = app.config.get('TALER_WEBHOOK_SLOW_HANDLER_SECONDS')
+
+        # Backends retry webhooks: optionally remember processed deliveries to drop duplicates
+        self.webhook_dedup = dedup_store_from_config(app)
+
+        # In async mode, webhooks are queued and processed by a pool of worker threads
+        if app.config.get('TALER_WEBHOOK_ASYNC', False):
+            self.webhook_queue = queue_from_config(app)
+            self.webhook_workers = WorkerPool(self.webhook_queue, self._process_webhook,
+                                              app.config.get('TALER_WEBHOOK_WORKERS', 2))
+            self.webhook_workers.start()
 
         # Register the extension with the app
         app.extensions['taler'] = self
@@ -64,39 +156,58 @@ class Taler(object):
         if 'taler' not in g:
             g.taler = self
 
-    def create_order(self, amount, currency=None, order_id=None, product_description=None, fulfillment_url=None,
-                     metadata=None, auto_refund=None, pay_deadline=None, refund_deadline=None, public_reorder_url=None):
+    def _call(self, operation, order_id=None, idempotent=None, **kwargs):
         """
-        Create a new payment order with the Taler merchant backend.
+        Calls a merchant backend endpoint through the transport.
 
         Args:
-            amount (float): The amount to be paid.
-            currency (str, optional): The currency code (e.g., "EUR"). Defaults to the configured default currency.
-            order_id (str, optional): An optional custom order ID. If not provided, the backend will generate one.
-            product_description (str, optional): A description of the product or service.
-            fulfillment_url (str, optional): The URL to redirect to after successful payment.
-            metadata (dict, optional): Additional metadata to store with the order.
-            auto_refund (dict, optional): Auto refund time.
-            pay_deadline (dict, optional): Pay deadline timestamp.
-            refund_deadline (dict, optional): Refund deadline timestamp.
-            public_reorder_url (str, optional): Public URL for reordering.
+            operation (str): The operation name, a key of `self.endpoints`.
+            order_id (str, optional): The ID of the order, if the endpoint is about an order.
+            idempotent (bool, optional): Overrides the idempotency of the endpoint.
+            **kwargs: Other arguments of `requests.Session.request`.
 
         Returns:
-            dict: The order details returned by the Taler backend, including the order ID and payment URL.
+            requests.Response: The response of the backend.
         """
-        currency = currency or self.default_currency
-
-        headers = {
-            'Accept': 'application/json',
-            'Authorization': f'Basic {self.merchant_api_key}',
-            'Content-Type': 'application/json',
-        }
+        endpoint = self.endpoints[operation]
+        if idempotent is None:
+            idempotent = endpoint.idempotent
+        return self.transport.request(endpoint.method, endpoint.url(order_id), operation, order_id,
+                                      idempotent=idempotent, headers=endpoint.headers, **kwargs)
+
+    def _decode(self, response):
+        """Decodes the JSON body of a backend response, raising `requests.exceptions.InvalidJSONError`."""
+        try:
+            return self.codec.loads(response.content)
+        except ValueError as e:
+            raise requests.exceptions.InvalidJSONError(f"Invalid JSON response from {response.url}: {e}",
+                                                       response=response) from e
+
+    async def _acall(self, operation, order_id=None, idempotent=None, **kwargs):
+        """Async version of `_call`, returning an `httpx.Response`."""
+        endpoint = self.endpoints[operation]
+        if idempotent is None:
+            idempotent = endpoint.idempotent
+        return await self.transport.async_request(endpoint.method, endpoint.url(order_id), operation, order_id,
+                                                  idempotent=idempotent, headers=endpoint.headers, **kwargs)
+
+    def _coerce_amount(self, amount, currency=None):
+        """Converts an order amount to an `Amount`. Amounts without a currency are in `currency` or the default one."""
+        if not isinstance(amount, Amount) and not (isinstance(amount, str) and ':' in amount):
+            currency = currency or self.default_currency
+        return Amount.coerce(amount, currency)
+
+    def _order_data(self, amount, currency=None, order_id=None, product_description=None, fulfillment_url=None,
+                    metadata=None, auto_refund=None, pay_deadline=None, refund_deadline=None,
+                    public_reorder_url=None):
+        """Builds the body of a `POST /private/orders` request."""
+        amount = self._coerce_amount(amount, currency)
 
         order_data = {
             "order": {
                 "summary": product_description,
                 "order_id": order_id,
-                "amount": f"{currency}:{amount}",
+                "amount": str(amount),
                 "public_reorder_url": public_reorder_url,
                 "fulfillment_url": fulfillment_url,
                 "refund_deadline": refund_deadline,
@@ -109,15 +220,138 @@ class Taler(object):
         if metadata is not None:
             order_data['order']['metadata'] = metadata
 
-        url = urljoin(self.merchant_backend_url, '/private/orders')
+        return order_data
+
+    def _refund_data(self, amount=None, reason=None):
+        """Builds the body of a `POST /private/orders/{id}/refund` request."""
+        refund_data = {}
+        if amount is not None:
+            refund_data['refund'] = str(Amount.coerce(amount, self.default_currency))
+        if reason is not None:
+            refund_data['reason'] = reason
+        return refund_data
+
+    def _pay_uri(self, order_id, claim_token=None, session_id=None):
+        """
+        Builds the `taler://pay` URI of an order, without asking the backend.
+
+        The URI is derived from the merchant backend URL (host and instance path, resolved
+        like the endpoints the order was created with), the order ID and the claim token
+        returned when the order was created.
+        """
+        parts = urlsplit(backend_root(self.merchant_backend_url))
+        scheme = 'taler' if parts.scheme == 'https' else 'taler+http'
+        instance_path = parts.path.lstrip('/')  # Empty, or ending with a slash
+
+        uri = f"{scheme}://pay/{parts.netloc}/{instance_path}{quote(order_id, safe='')}/{session_id or ''}"
+        if claim_token:
+            uri += f"?c={quote(claim_token, safe='')}"
+        return uri
+
+    def _add_pay_uri(self, order):
+        """Adds the locally built `taler_pay_uri` to a create order response."""
+        order['taler_pay_uri'] = self._pay_uri(order['order_id'], order.get('token'))
+        return order
+
+    def create_order(self, amount, currency=None, order_id=None, product_description=None, fulfillment_url=None,
+                     metadata=None, auto_refund=None, pay_deadline=None, refund_deadline=None, public_reorder_url=None,
+                     return_payment_url=False):
+        """
+        Create a new payment order with the Taler merchant backend.
+
+        Args:
+            amount (Amount, str or number): The amount to be paid: an `Amount`, an amount string
+                like `'EUR:10.25'`, or a number (or numeric string like `'10.25'`) in `currency`.
+            currency (str, optional): The currency code (e.g., "EUR"). Defaults to the configured default currency.
+            order_id (str, optional): An optional custom order ID. If not provided, the backend will generate one.
+            product_description (str, optional): A description of the product or service.
+            fulfillment_url (str, optional): The URL to redirect to after successful payment.
+            metadata (dict, optional): Additional metadata to store with the order.
+            auto_refund (dict, optional): Auto refund time.
+            pay_deadline (dict, optional): Pay deadline timestamp.
+            refund_deadline (dict, optional): Refund deadline timestamp.
+            public_reorder_url (str, optional): Public URL for reordering.
+            return_payment_url (bool, optional): Also return the payment URL, under the `taler_pay_uri`
+                key. It is built locally from the backend response, which saves a `get_payment_url` call.
+
+        Returns:
+            dict: The order details returned by the Taler backend, including the order ID and payment URL.
+        """
+        order_data = self._order_data(amount, currency, order_id, product_description, fulfillment_url,
+                                      metadata, auto_refund, pay_deadline, refund_deadline, public_reorder_url)
+
         try:
-            response = requests.post(url, headers=headers, json=order_data)
+            # With an explicit order ID, the backend rejects duplicates: retrying is safe
+            response = self._call('create_order', order_id, idempotent=order_id is not None,
+                                  data=self.codec.dumps(order_data))
+            if self._created_by_lost_attempt(response, order_id):
+                order = {'order_id': order_id}
+                if return_payment_url:
+                    order['taler_pay_uri'] = self.get_payment_url(order_id)
+                return order
             response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
-            return response.json()
+            order = self._decode(response)
         except requests.exceptions.RequestException as e:
-            logger.error(f"Error creating order: {e}")
+            logger.error("Error creating order: %s", e)
             raise
 
+        if return_payment_url:
+            self._add_pay_uri(order)
+        return order
+
+    @staticmethod
+    def _created_by_lost_attempt(response, order_id):
+        """
+        Returns True if a create order call was rejected as a duplicate of its own earlier attempt.
+
+        This happens when the backend created the order, but its response was lost and the call
+        was retried. The claim token is lost with the response: the backend includes it in the
+        payment URL of the order instead.
+        """
+        return order_id is not None and response.status_code == 409 and getattr(response, 'attempts', 1) > 1
+
+    def create_checkout(self, amount, **kwargs):
+        """
+        Creates an order and returns its payment URL, in a single backend round-trip.
+
+        This is equivalent to `create_order` followed by `get_payment_url`, but the payment
+        URL is built from the order creation response instead of being fetched.
+
+        Args:
+            amount (Amount, str or number): The amount to be paid.
+            **kwargs: Other arguments of `create_order`.
+
+        Returns:
+            tuple: The order ID and the payment URL.
+        """
+        order = self.create_order(amount, return_payment_url=True, **kwargs)
+        return order['order_id'], order['taler_pay_uri']
+
+    def create_orders(self, specs, concurrency=None):
+        """
+        Creates many orders concurrently, over the shared connection pool.
+
+        Results are streamed back as orders are created, and a failure on one order does not
+        abort the batch. Input specs are consumed lazily, so large batches run in constant memory.
+
+        Example:
+
+            specs = ({'amount': invoice.total, 'order_id': invoice.ref} for invoice in invoices)
+            for result in taler.create_orders(specs, concurrency=16):
+                if not result.ok:
+                    logger.warning("Order %s failed: %s", result.item['order_id'], result.error)
+
+        Args:
+            specs (iterable): Dicts of keyword arguments for `create_order`.
+            concurrency (int, optional): Maximum number of orders created at once. Defaults to
+                `TALER_HTTP_POOL_SIZE`; higher values open connections that are not pooled.
+
+        Yields:
+            BatchResult: One per spec, in completion order, holding the created order or the error.
+        """
+        return iter_concurrent(lambda spec: self.create_order(**spec), specs,
+                               concurrency or self.transport.pool_size)
+
     def get_payment_url(self, order_id):
         """
         Retrieves the payment URL for a given order ID.
@@ -128,46 +362,215 @@ class Taler(object):
         Returns:
             str: The payment URL, or None if the order is not found or not payable.
         """
-        headers = {
-            'Accept': 'application/json',
-            'Authorization': f'Basic {self.merchant_api_key}',
-        }
+        order_data = self.get_order(order_id)
+        if order_data is None:
+            return None
+        return order_data.get('taler_pay_uri')
+
+    def get_order(self, order_id, model=False):
+        """
+        Retrieves the order details for a given order ID.
+
+        Concurrent calls for the same order ID share a single backend request, and
+        receive the same dict, which must not be mutated.
+
+        Args:
+            order_id (str): The ID of the order.
+            model (bool, optional): Return an `Order`, wrapping the order details, instead of a dict.
+
+        Returns:
+            dict or Order: The order details, or None if the order is not found.
+        """
+        if self.order_cache is not None:
+            order_data = self.order_cache.get(order_id)
+            if order_data is not None:
+                return Order(order_data) if model else order_data
+
+        order_data = self._load_order(order_id)
+        return Order(order_data) if model and order_data is not None else order_data
+
+    def _load_order(self, order_id):
+        """Fetches an order missing from the cache, sharing concurrent lookups, and caches it."""
+        order_data = self._order_flights.do(order_id, self._fetch_order, order_id)
+        if order_data is not None and self.order_cache is not None:
+            self.order_cache.set(order_id, order_data)
+        return order_data
+
+    def get_orders(self, order_ids, concurrency=None, model=False):
+        """
+        Retrieves the details of many orders concurrently, over the shared connection pool.
 
-        url = urljoin(self.merchant_backend_url, f'/private/orders/{order_id}')
+        Orders found in the cache are not fetched again, duplicate IDs are fetched once, and
+        lookups of orders already in flight in other threads are shared, as with `get_order`.
 
+        Args:
+            order_ids (iterable): The IDs of the orders.
+            concurrency (int, optional): Maximum number of orders fetched at once. Defaults to
+                `TALER_HTTP_POOL_SIZE`.
+            model (bool, optional): Return `Order` objects instead of dicts.
+
+        Returns:
+            dict: The order details by order ID, in the order of `order_ids`, with None for the
+                orders which could not be retrieved.
+        """
+        orders = dict.fromkeys(order_ids)
+        missing = []
+        for order_id in orders:
+            order_data = self.order_cache.get(order_id) if self.order_cache is not None else None
+            if order_data is None:
+                missing.append(order_id)
+            else:
+                orders[order_id] = Order(order_data) if model else order_data
+
+        for result in iter_concurrent(self._load_order, missing, concurrency or self.transport.pool_size):
+            if not result.ok:
+                logger.error("Error retrieving order %s: %s", result.item, result.error)
+            order_data = result.result
+            orders[result.item] = Order(order_data) if model and order_data is not None else order_data
+        return orders
+
+    def _fetch_order(self, order_id, params=None, operation='get_order'):
+        """Fetches the order details from the backend, bypassing the cache."""
         try:
-            response = requests.get(url, headers=headers)
+            response = self._call(operation, order_id, timeout=self._long_poll_timeout(operation, params),
+                                  params=params)
             response.raise_for_status()
-            order_data = response.json()
-            return order_data.get('taler_pay_uri')
+            return self._decode(response)
         except requests.exceptions.RequestException as e:
-            logger.error(f"Error retrieving payment URL for order {order_id}: {e}")
+            logger.error("Error retrieving order %s: %s", order_id, e)
             return None
 
-    def get_order(self, order_id):
+    def _long_poll_timeout(self, operation, params):
+        """Returns the timeouts of a long polling request, whose read timeout includes the polling time."""
+        if not params or 'timeout_ms' not in params:
+            return None  # Use the default timeouts of the operation
+        connect, read = self.transport.timeout_for(operation)
+        return connect, read + params['timeout_ms'] / 1000
+
+    def wait_for_payment(self, order_id, timeout=30, min_interval=1):
         """
-        Retrieves the order details for a given order ID.
+        Waits until an order is paid, or the timeout expires.
+
+        This uses the long polling support of the merchant backend (`timeout_ms`): the backend
+        holds each request until the order status changes, so the payment is seen as soon as it
+        happens, with a handful of requests instead of one poll per second.
 
         Args:
             order_id (str): The ID of the order.
+            timeout (float, optional): Maximum time to wait, in seconds.
+            min_interval (float, optional): Minimum time between two requests, in seconds, in case
+                the backend answers before the long polling timeout without the order being paid.
 
         Returns:
-            dict: The order details, or None if the order is not found.
+            dict: The last order details received, which have an `order_status` of `paid` if the
+                order was paid in time, or None if the order could not be retrieved.
         """
-        headers = {
-            'Accept': 'application/json',
-            'Authorization': f'Basic {self.merchant_api_key}',
-        }
+        deadline = time.monotonic() + timeout
+        while True:
+            started = time.monotonic()
+            timeout_ms = max(0, int((deadline - started) * 1000))
+            order_data = self._fetch_order(order_id, {'timeout_ms': timeout_ms}, 'wait_for_payment')
+            if order_data is None:
+                return None
+
+            if self.order_cache is not None:
+                self.order_cache.set(order_id, order_data)
+            if order_data.get('order_status') == 'paid' or time.monotonic() >= deadline:
+                return order_data
+
+            time.sleep(max(0, min(started + min_interval, deadline) - time.monotonic()))
+
+    def iter_orders(self, paid=None, refunded=None, wired=None, date=None, start=None, descending=False,
+                    page_size=100, prefetch=False, model=False):
+        """
+        Iterates over the orders of the merchant backend, page by page.
+
+        Pages are fetched lazily, as the iteration progresses, so that iterating over any number
+        of orders holds at most one page (two with `prefetch`) in memory. Pages are delimited by
+        the row ID of their last order, so orders created during the iteration do not shift them.
 
-        url = urljoin(self.merchant_backend_url, f'/private/orders/{order_id}')
+        Example:
 
+            unpaid = Amount.sum((order['amount'] for order in taler.iter_orders(paid=False)), 'EUR')
+
+        Args:
+            paid (bool, optional): Only list paid (True) or unpaid (False) orders.
+            refunded (bool, optional): Only list refunded (True) or not refunded (False) orders.
+            wired (bool, optional): Only list orders whose payment was (True) or was not (False) wired
+                to the merchant.
+            date (datetime or int, optional): Only list orders created after (or before, if
+                `descending`) this date, given as a datetime or a timestamp in seconds.
+            start (int, optional): Only list orders after (or before, if `descending`) this row ID,
+                e.g. the `row_id` of the last order seen by a previous iteration.
+            descending (bool, optional): List the most recent orders first.
+            page_size (int, optional): Number of orders fetched per backend request.
+            prefetch (bool, optional): Fetch the next page in a background thread while the
+                current page is being consumed.
+            model (bool, optional): Yield `Order` objects instead of dicts.
+
+        Yields:
+            dict or Order: The orders, with their `order_id`, `row_id`, `timestamp`, `amount`,
+                `summary`, `refundable` and `paid` fields.
+
+        Raises:
+            requests.exceptions.RequestException: If a page could not be fetched.
+        """
+        params = {'delta': -page_size if descending else page_size}
+        for name, value in (('paid', paid), ('refunded', refunded), ('wired', wired)):
+            if value is not None:
+                params[name] = 'yes' if value else 'no'
+        if date is not None:
+            params['date_s'] = int(date.timestamp()) if isinstance(date, datetime) else int(date)
+
+        executor = ThreadPoolExecutor(1, thread_name_prefix='taler-orders') if prefetch else None
         try:
-            response = requests.get(url, headers=headers)
+            page = self._fetch_orders_page(params, start)
+            while page:
+                next_page = None
+                if len(page) >= page_size:
+                    if executor is not None:
+                        next_page = executor.submit(self._fetch_orders_page, params, page[-1]['row_id'])
+                    else:
+                        start = page[-1]['row_id']
+
+                for order in page:
+                    yield Order(order) if model else order
+
+                if len(page) < page_size:
+                    return
+                page = next_page.result() if next_page is not None else self._fetch_orders_page(params, start)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def _fetch_orders_page(self, params, start):
+        """Fetches a page of the order list from the backend."""
+        if start is not None:
+            params = dict(params, start=start)
+        try:
+            response = self._call('list_orders', params=params)
             response.raise_for_status()
-            return response.json()
+            return self._decode(response)['orders']
         except requests.exceptions.RequestException as e:
-            logger.error(f"Error retrieving order {order_id}: {e}")
-            return None
+            logger.error("Error listing orders: %s", e)
+            raise
+
+    def sync_orders(self, page_size=500):
+        """
+        Updates the local order mirror (see `TALER_ORDER_MIRROR`) from the merchant backend.
+
+        Only the orders created since the previous sync are listed, and only the orders changed
+        since (as notified by webhooks) are fetched again.
+
+        Args:
+            page_size (int, optional): Number of orders listed per backend request.
+
+        Returns:
+            int: The number of orders added to the mirror or refreshed.
+        """
+        if self.order_mirror is None:
+            raise RuntimeError("The order mirror is not enabled (see TALER_ORDER_MIRROR)")
+        return self.order_mirror.sync(self, page_size)
 
     def process_refund(self, order_id, amount=None, reason=None):
         """
@@ -175,34 +578,259 @@ class Taler(object):
 
         Args:
             order_id (str): The ID of the order to refund.
-            amount (float, optional): The amount to refund. If None, a full refund is issued.
+            amount (Amount, str or number, optional): The amount to refund. Numbers are in the
+                default currency. If None, a full refund is issued.
             reason (str, optional): The reason for the refund.
 
         Returns:
             dict: The refund response from the Taler backend.
         """
-        headers = {
-            'Accept': 'application/json',
-            'Authorization': f'Basic {self.merchant_api_key}',
-            'Content-Type': 'application/json',
-        }
+        refund_data = self._refund_data(amount, reason)
 
-        refund_data = {}
+        try:
+            response = self._call('process_refund', order_id, data=self.codec.dumps(refund_data))
+            response.raise_for_status()
+            return self._decode(response)
+        except requests.exceptions.RequestException as e:
+            logger.error("Error processing refund for order %s: %s", order_id, e)
+            raise
+        finally:
+            self._invalidate_order(order_id)
+
+    def process_refunds(self, refunds, concurrency=None, rate=None, checkpoint=None):
+        """
+        Refunds many orders concurrently, over the shared connection pool.
+
+        Outcomes are streamed back as refunds complete, and a failure on one order does not
+        abort the batch. With a `checkpoint` file, an interrupted batch can be resumed by
+        running it again with the same file: orders already refunded are skipped. Refunds
+        that were in progress when the batch was interrupted are sent again. This does not
+        refund them twice, as Taler refund amounts are the total refunded on the order.
+
+        Example:
+
+            refunds = ({'order_id': order_id, 'reason': 'Product recall'} for order_id in recalled)
+            for result in taler.process_refunds(refunds, concurrency=8, rate=20, checkpoint='recall.log'):
+                if not result.ok:
+                    logger.warning("Refund of %s failed: %s", result.item['order_id'], result.error)
+
+        Args:
+            refunds (iterable): Order IDs (for full refunds), or dicts of keyword arguments for
+                `process_refund`. They are consumed lazily.
+            concurrency (int, optional): Maximum number of refunds in flight. Defaults to
+                `TALER_HTTP_POOL_SIZE`.
+            rate (float, optional): Maximum number of refunds started per second. Defaults to
+                `TALER_REFUND_RATE`, or no limit.
+            checkpoint (str, optional): The path of a file recording the progress of the batch.
+
+        Yields:
+            BatchResult: One per refund, in completion order, holding the refund response or the
+                error. Refunds skipped because a previous run did them have a None result.
+        """
+        rate = rate or self.refund_rate
+        bucket = TokenBucket(rate, capacity=max(1, int(rate))) if rate else None
+        log = Checkpoint(checkpoint, self.codec) if checkpoint else None
+
+        def refund(item):
+            kwargs = {'order_id': item} if isinstance(item, str) else item
+            order_id = kwargs['order_id']
+            if log is not None and log.is_done(order_id):
+                return None
+            if bucket is not None:
+                bucket.acquire()
+            if log is not None:
+                log.mark_pending(order_id)
+            result = self.process_refund(**kwargs)
+            if log is not None:
+                log.mark_done(order_id)
+            return result
+
+        try:
+            yield from iter_concurrent(refund, refunds, concurrency or self.transport.pool_size)
+        finally:
+            if log is not None:
+                log.close()
+
+    def enqueue_order(self, amount, currency=None, order_id=None, **kwargs):
+        """
+        Adds an order creation to the outbox (see `TALER_OUTBOX`), to be sent in the background.
+
+        An order ID is generated if none is given, so that the creation can be retried safely,
+        and the order can be referred to before it is created.
+
+        Args:
+            amount (Amount, str or number): The amount to be paid.
+            currency (str, optional): The currency of `amount`, if it is a number.
+            order_id (str, optional): The ID of the order.
+            **kwargs: Other arguments of `create_order`.
+
+        Returns:
+            str: The ID of the order.
+        """
+        kwargs.update(amount=str(self._coerce_amount(amount, currency)), order_id=order_id or uuid.uuid4().hex)
+        self._order_data(**kwargs)  # Fail now on invalid arguments, not in the background
+        self._require_outbox().put('create_order', kwargs)
+        return kwargs['order_id']
+
+    def enqueue_refund(self, order_id, amount=None, reason=None):
+        """
+        Adds a refund to the outbox (see `TALER_OUTBOX`), to be sent in the background.
+
+        Args:
+            order_id (str): The ID of the order to refund.
+            amount (Amount, str or number, optional): The amount to refund. Numbers are in the
+                default currency. If None, a full refund is issued.
+            reason (str, optional): The reason for the refund.
+
+        Returns:
+            int: The ID of the outbox entry.
+        """
         if amount is not None:
-            refund_data['refund'] = str(amount)
-        if reason is not None:
-            refund_data['reason'] = reason
+            amount = str(Amount.coerce(amount, self.default_currency))
+        return self._require_outbox().put('process_refund', {'order_id': order_id, 'amount': amount,
+                                                             'reason': reason})
+
+    def _require_outbox(self):
+        if self.outbox is None:
+            raise RuntimeError("The outbox is not enabled (see TALER_OUTBOX)")
+        return self.outbox
+
+    def _send_outbox_entry(self, operation, kwargs, attempt):
+        """Sends a call from the outbox to the backend, in the outbox thread."""
+        if operation == 'process_refund':
+            return self.process_refund(**kwargs)
+        if operation != 'create_order':
+            raise ValueError(f"Unknown outbox operation: {operation}")
+        try:
+            return self.create_order(**kwargs)
+        except requests.exceptions.HTTPError as e:
+            # The order was created by a previous outbox attempt, whose response was lost (retries
+            # within an attempt are handled by create_order)
+            if attempt > 1 and e.response is not None and e.response.status_code == 409:
+                return None
+            raise
+
+    def _invalidate_order(self, order_id):
+        """Drops an order whose state changed from the cache."""
+        if self.order_cache is not None:
+            self.order_cache.invalidate(order_id)
 
-        url = urljoin(self.merchant_backend_url, f'/private/orders/{order_id}/refund')
+    # Async API, for `async def` views and asyncio workers. These methods mirror
+    # their blocking counterparts, but run on a pooled `httpx.AsyncClient` (see
+    # `Transport`), and raise the same `requests` exceptions.
+
+    async def acreate_order(self, amount, currency=None, order_id=None, product_description=None,
+                            fulfillment_url=None, metadata=None, auto_refund=None, pay_deadline=None,
+                            refund_deadline=None, public_reorder_url=None, return_payment_url=False):
+        """Async version of `create_order`."""
+        order_data = self._order_data(amount, currency, order_id, product_description, fulfillment_url,
+                                      metadata, auto_refund, pay_deadline, refund_deadline, public_reorder_url)
 
         try:
-            response = requests.post(url, headers=headers, json=refund_data)
-            response.raise_for_status()
-            return response.json()
+            response = await self._acall('create_order', order_id, idempotent=order_id is not None,
+                                         content=self.codec.dumps(order_data))
+            if self._created_by_lost_attempt(response, order_id):
+                order = {'order_id': order_id}
+                if return_payment_url:
+                    order['taler_pay_uri'] = await self.aget_payment_url(order_id)
+                return order
+            raise_for_status(response)
+            order = self._decode(response)
         except requests.exceptions.RequestException as e:
-            logger.error(f"Error processing refund for order {order_id}: {e}")
+            logger.error("Error creating order: %s", e)
             raise
 
+        if return_payment_url:
+            self._add_pay_uri(order)
+        return order
+
+    async def acreate_checkout(self, amount, **kwargs):
+        """Async version of `create_checkout`."""
+        order = await self.acreate_order(amount, return_payment_url=True, **kwargs)
+        return order['order_id'], order['taler_pay_uri']
+
+    async def aget_payment_url(self, order_id):
+        """Async version of `get_payment_url`."""
+        order_data = await self.aget_order(order_id)
+        if order_data is None:
+            return None
+        return order_data.get('taler_pay_uri')
+
+    async def aget_order(self, order_id, model=False):
+        """Async version of `get_order`."""
+        if self.order_cache is not None:
+            order_data = self.order_cache.get(order_id)
+            if order_data is not None:
+                return Order(order_data) if model else order_data
+
+        order_data = await self._async_order_flights.do(order_id, self._afetch_order, order_id)
+        if order_data is not None and self.order_cache is not None:
+            self.order_cache.set(order_id, order_data)
+        return Order(order_data) if model and order_data is not None else order_data
+
+    async def _afetch_order(self, order_id, params=None, operation='get_order'):
+        """Async version of `_fetch_order`."""
+        try:
+            response = await self._acall(operation, order_id, timeout=self._long_poll_timeout(operation, params),
+                                         params=params)
+            raise_for_status(response)
+            return self._decode(response)
+        except requests.exceptions.RequestException as e:
+            logger.error("Error retrieving order %s: %s", order_id, e)
+            return None
+
+    async def await_for_payment(self, order_id, timeout=30, min_interval=1):
+        """Async version of `wait_for_payment`."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            started = loop.time()
+            timeout_ms = max(0, int((deadline - started) * 1000))
+            order_data = await self._afetch_order(order_id, {'timeout_ms': timeout_ms}, 'wait_for_payment')
+            if order_data is None:
+                return None
+
+            if self.order_cache is not None:
+                self.order_cache.set(order_id, order_data)
+            if order_data.get('order_status') == 'paid' or loop.time() >= deadline:
+                return order_data
+
+            await asyncio.sleep(max(0, min(started + min_interval, deadline) - loop.time()))
+
+    async def aprocess_refund(self, order_id, amount=None, reason=None):
+        """Async version of `process_refund`."""
+        refund_data = self._refund_data(amount, reason)
+
+        try:
+            response = await self._acall('process_refund', order_id, content=self.codec.dumps(refund_data))
+            raise_for_status(response)
+            return self._decode(response)
+        except requests.exceptions.RequestException as e:
+            logger.error("Error processing refund for order %s: %s", order_id, e)
+            raise
+        finally:
+            self._invalidate_order(order_id)
+
+    def on(self, event_type):
+        """
+        Decorator registering a handler for a type of webhook event.
+
+        Handlers are called with the decoded event by `handle_webhook`. Several handlers can be
+        registered for the same event type, and handlers registered for `'*'` receive all events.
+
+        Example:
+
+            @taler.on("payment.succeeded")
+            def fulfill_order(event):
+                ship(event["payload"]["order_id"])
+
+        Args:
+            event_type (str): The type of event to handle, e.g. "payment.succeeded".
+        """
+        def decorator(func):
+            return self.webhook_handlers.register(event_type, func)
+        return decorator
+
     def verify_webhook_signature(self, payload, signature):
         """
         Verifies the HMAC signature of a Taler webhook payload.
@@ -253,6 +881,15 @@ class Taler(object):
                     current_app.logger.error(f"Error processing Taler webhook: {e}")
                     return "Internal Server Error", 500
 
+        The decoded event is passed to the handlers registered with `on` for its type.
+
+        If `TALER_WEBHOOK_DEDUP` is set, duplicate deliveries (same signed payload, or same event
+        ID, or same order ID and event type) are acknowledged without being processed again.
+
+        If `TALER_WEBHOOK_ASYNC` is set, the webhook is only verified and queued here, and
+        processed by a pool of worker threads, so the response does not wait for the event
+        handling. A 503 error is returned if the queue is full, so that the backend retries later.
+
         Returns:
             bool: True if the webhook was processed successfully, False otherwise.
         """
@@ -263,23 +900,98 @@ class Taler(object):
             logger.error("Invalid webhook signature.")
             abort(400, "Invalid signature")  # Signature verification failed
 
+        # A retried delivery has the same signature: drop it before decoding the payload
+        delivery_key = f"sig:{signature}"
+        if self.webhook_dedup is not None and not self.webhook_dedup.add(delivery_key):
+            logger.info("Duplicate webhook delivery ignored.")
+            return True
+
+        try:
+            if self.webhook_queue is not None:
+                try:
+                    self.webhook_queue.put(data)
+                except queue.Full:
+                    logger.error("Webhook queue is full.")
+                    abort(503, "Webhook queue is full")
+                return True  # Webhook queued for processing
+
+            try:
+                event = self.codec.loads(data)
+            except ValueError:
+                logger.error("Invalid JSON payload in webhook.")
+                abort(400, "Invalid JSON payload")
+
+            self._process_event(event)
+        except Exception:
+            # Let the backend retry the delivery
+            if self.webhook_dedup is not None:
+                self.webhook_dedup.discard(delivery_key)
+            raise
+
+        return True  # Webhook processed successfully
+
+    def _process_webhook(self, data):
+        """Processes the raw payload of a queued webhook, in a worker thread."""
         try:
-            event = json.loads(data.decode('utf-8'))
-        except json.JSONDecodeError as e:
+            event = self.codec.loads(data)
+        except ValueError:
             logger.error("Invalid JSON payload in webhook.")
-            abort(400, "Invalid JSON payload")
+            return
 
-        logger.info(f"Received Taler webhook: {event}")
+        # Handlers can use current_app, as in synchronous mode
+        with self.app.app_context():
+            self._process_event(event)
 
-        # Process the event
-        if event.get("type") == "payment.succeeded":
-            order_id = event["payload"]["order_id"]
-            logger.info(f"Payment succeeded for order: {order_id}")
-        elif event.get("type") == "payment.failed":
-            order_id = event["payload"]["order_id"]
-            logger.info(f"Payment failed for order: {order_id}")
-        # handle other event types
+    def _process_event(self, event):
+        """Processes a decoded webhook event."""
+        key = event_key(event) if self.webhook_dedup is not None else None
+        if key is not None and not self.webhook_dedup.add(key):
+            logger.info("Duplicate webhook event ignored: %s", key)
+            return
 
-        return True  # Webhook processed successfully
+        try:
+            self._dispatch_event(event)
+        except Exception:
+            if key is not None:
+                self.webhook_dedup.discard(key)
+            raise
+
+    def _dispatch_event(self, event):
+        """Runs the handlers of a decoded webhook event."""
+        payload = event.get("payload")
+        order_id = payload.get("order_id") if isinstance(payload, dict) else None
+        self._log_event(event, order_id)
+
+        # The order changed: drop it from the cache, and mark it for refresh in the mirror
+        if order_id:
+            self._invalidate_order(order_id)
+            if self.order_mirror is not None:
+                self.order_mirror.apply_event(event)
+
+        # Process the event with the registered handlers
+        attributes = {'taler.event_type': str(event.get("type")), 'taler.order_id': str(order_id)}
+        with self.tracer.span('taler.webhook', attributes, kind='internal') as span:
+            handled = self.webhook_handlers.dispatch(event)
+            span.set_attribute('taler.handlers', handled)
+        if not handled:
+            logger.info("No handler for webhook event type: %s", event.get("type"))
+
+    def _log_event(self, event, order_id):
+        """
+        Logs a received webhook event.
+
+        The full payload is only attached to a sample of the records, and is rendered lazily
+        and truncated, so that bursts of webhooks do not spend time formatting them.
+        """
+        if not logger.isEnabledFor(logging.INFO):
+            return
+
+        extra = {'taler_event_type': event.get("type"), 'taler_order_id': order_id}
+        rate = self.webhook_log_sample_rate
+        if rate >= 1 or (rate > 0 and random.random() < rate):
+            logger.info("Received Taler webhook %s for order %s: %s", event.get("type"), order_id,
+                        TruncatedRepr(event, self.webhook_log_max_size), extra=extra)
+        else:
+            logger.info("Received Taler webhook %s for order %s", event.get("type"), order_id, extra=extra)
 
     # ... other methods for wallet operations, Dolibarr integration, etc. ...
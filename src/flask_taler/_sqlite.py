@@ -0,0 +1,22 @@
+"""
+SQLite helpers shared by the durable stores of the extension.
+"""
+import os
+import sqlite3
+
+
+def connect(path):
+    """
+    Opens a SQLite database shared by the threads of a process.
+
+    The connection is in autocommit mode (transactions are opened explicitly),
+    uses WAL journaling so readers do not block the writer, and waits for locks
+    held by other processes instead of failing immediately.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
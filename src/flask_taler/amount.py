@@ -0,0 +1,198 @@
+"""
+Exact Taler amounts.
+
+Taler amounts are written `CURRENCY:VALUE.FRACTION`, e.g. `EUR:10.25`, and are
+made of an integer value and a fraction in units of 10^-8. Unlike floats,
+`Amount` objects represent them exactly: `Amount('EUR', 0, 10000000) * 3` is
+`EUR:0.3`, not `EUR:0.30000000000000004`.
+"""
+from decimal import Decimal, InvalidOperation
+from functools import total_ordering
+
+FRACTION_DIGITS = 8
+FRACTION_BASE = 10 ** FRACTION_DIGITS
+MAX_VALUE = 2 ** 52
+MAX_CURRENCY_LENGTH = 11
+
+
+@total_ordering
+class Amount(object):
+    """
+    An amount of money in a currency, as specified by Taler.
+
+    Amounts are immutable. They can be added and subtracted (in the same currency),
+    multiplied by integers, and compared. Results are checked to remain in the
+    range Taler accepts: between zero and 2^52, with 8 fractional digits.
+
+    Attributes:
+        currency (str): The currency code, e.g. `'EUR'`.
+        value (int): The integer part of the amount.
+        fraction (int): The fractional part of the amount, in units of 10^-8.
+    """
+    __slots__ = ('currency', 'value', 'fraction')
+
+    def __init__(self, currency, value=0, fraction=0):
+        if not currency or len(currency) > MAX_CURRENCY_LENGTH:
+            raise ValueError(f"Invalid currency: {currency!r}")
+        value += fraction // FRACTION_BASE
+        fraction %= FRACTION_BASE
+        if not 0 <= value <= MAX_VALUE:
+            raise ValueError(f"Amount out of range: {currency}:{value}")
+        object.__setattr__(self, 'currency', currency)
+        object.__setattr__(self, 'value', value)
+        object.__setattr__(self, 'fraction', fraction)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Amount objects are immutable")
+
+    @classmethod
+    def _from_units(cls, currency, units):
+        if units < 0:
+            raise ValueError(f"Negative amount in {currency}")
+        value, fraction = divmod(units, FRACTION_BASE)
+        return cls(currency, value, fraction)
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Parses an amount string, e.g. `'EUR:10.25'`.
+
+        Raises:
+            ValueError: If the string is not a valid amount.
+        """
+        currency, sep, number = text.partition(':')
+        if not sep:
+            raise ValueError(f"Invalid amount: {text!r}")
+        value, sep, digits = number.partition('.')
+        if (not value.isdigit() or not value.isascii() or (sep and not digits)
+                or len(digits) > FRACTION_DIGITS or (digits and not (digits.isdigit() and digits.isascii()))):
+            raise ValueError(f"Invalid amount: {text!r}")
+        return cls(currency, int(value), int(digits.ljust(FRACTION_DIGITS, '0')) if digits else 0)
+
+    @classmethod
+    def coerce(cls, amount, currency=None):
+        """
+        Converts an amount given in any supported form to an `Amount`.
+
+        Args:
+            amount: An `Amount`, an amount string (`'EUR:10.25'`), or a number (int, Decimal,
+                float, or numeric string like `'10.25'`, rounded to 8 fractional digits) in `currency`.
+            currency (str, optional): The currency of numbers. If `amount` has its own
+                currency, it must be the same.
+
+        Raises:
+            ValueError: If the amount is invalid, or its currency is not `currency`.
+        """
+        if isinstance(amount, str):
+            if ':' in amount:
+                amount = cls.parse(amount)
+            else:
+                try:
+                    amount = Decimal(amount)
+                except InvalidOperation:
+                    raise ValueError(f"Invalid amount: {amount!r}") from None
+        if isinstance(amount, Amount):
+            if currency and amount.currency != currency:
+                raise ValueError(f"Expected an amount in {currency}, got {amount}")
+            return amount
+
+        if not currency:
+            raise ValueError(f"No currency for amount {amount!r}")
+        if isinstance(amount, int):
+            return cls(currency, amount)
+        if isinstance(amount, float):
+            amount = Decimal(repr(amount))
+        if not isinstance(amount, Decimal) or not amount.is_finite():
+            raise ValueError(f"Invalid amount: {amount!r}")
+        return cls._from_units(currency, int(amount.scaleb(FRACTION_DIGITS).to_integral_value()))
+
+    @classmethod
+    def sum(cls, amounts, currency=None):
+        """
+        Sums amounts (`Amount` objects or amount strings), e.g. those of a list of orders.
+
+        Args:
+            amounts (iterable): The amounts, all in the same currency.
+            currency (str, optional): The currency of the total, required if `amounts` can be empty.
+
+        Raises:
+            ValueError: If an amount is invalid, or in another currency.
+        """
+        units = 0
+        for amount in amounts:
+            if not isinstance(amount, Amount):
+                amount = cls.parse(amount)
+            if currency is None:
+                currency = amount.currency
+            elif amount.currency != currency:
+                raise ValueError(f"Expected an amount in {currency}, got {amount}")
+            units += amount.value * FRACTION_BASE + amount.fraction
+        if currency is None:
+            raise ValueError("No currency for the sum of no amounts")
+        return cls._from_units(currency, units)
+
+    @property
+    def units(self):
+        """The amount in units of 10^-8."""
+        return self.value * FRACTION_BASE + self.fraction
+
+    def to_decimal(self):
+        """Returns the amount as a `Decimal`, without the currency."""
+        return Decimal(self.units).scaleb(-FRACTION_DIGITS)
+
+    def _number(self):
+        if not self.fraction:
+            return str(self.value)
+        return f"{self.value}.{self.fraction:08d}".rstrip('0')
+
+    def __str__(self):
+        return f"{self.currency}:{self._number()}"
+
+    def __repr__(self):
+        return f"<Amount {self}>"
+
+    def _units_of(self, other):
+        if not isinstance(other, Amount):
+            return NotImplemented
+        if other.currency != self.currency:
+            raise ValueError(f"Currency mismatch: {self.currency} and {other.currency}")
+        return other.value * FRACTION_BASE + other.fraction
+
+    def __add__(self, other):
+        units = self._units_of(other)
+        if units is NotImplemented:
+            return units
+        return self._from_units(self.currency, self.units + units)
+
+    def __sub__(self, other):
+        units = self._units_of(other)
+        if units is NotImplemented:
+            return units
+        return self._from_units(self.currency, self.units - units)
+
+    def __mul__(self, factor):
+        if not isinstance(factor, int):
+            return NotImplemented
+        return self._from_units(self.currency, self.units * factor)
+
+    __rmul__ = __mul__
+
+    def __eq__(self, other):
+        if not isinstance(other, Amount):
+            return NotImplemented
+        return (self.currency, self.value, self.fraction) == (other.currency, other.value, other.fraction)
+
+    def __lt__(self, other):
+        units = self._units_of(other)
+        if units is NotImplemented:
+            return units
+        return self.units < units
+
+    def __hash__(self):
+        return hash((self.currency, self.value, self.fraction))
+
+    def __bool__(self):
+        return bool(self.value or self.fraction)
+
+    def __reduce__(self):
+        return Amount, (self.currency, self.value, self.fraction)
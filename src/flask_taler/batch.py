@@ -0,0 +1,153 @@
+"""
+Concurrent execution of batches of merchant backend calls.
+"""
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+
+
+class BatchResult(namedtuple('BatchResult', ['index', 'item', 'result', 'error'])):
+    """
+    Outcome of one item of a batch.
+
+    Attributes:
+        index (int): Position of the item in the input iterable.
+        item: The input item.
+        result: The value returned for the item, or None if it failed.
+        error (Exception): The exception raised for the item, or None if it succeeded.
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        """True if the item was processed successfully."""
+        return self.error is None
+
+
+def iter_concurrent(func, items, concurrency):
+    """
+    Calls `func` on each item from a pool of threads, and yields results as they complete.
+
+    At most `concurrency` calls are in flight at any time, and items are consumed lazily,
+    so arbitrarily large iterables can be processed in constant memory. An exception raised
+    for one item is reported in its `BatchResult` and does not abort the batch.
+
+    Args:
+        func (callable): Called with each item.
+        items (iterable): The items to process.
+        concurrency (int): Maximum number of concurrent calls.
+
+    Yields:
+        BatchResult: One per item, in completion order.
+    """
+    items = enumerate(items)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+
+        def submit(batch):
+            for index, item in batch:
+                pending[executor.submit(func, item)] = (index, item)
+
+        submit(islice(items, concurrency))
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, item = pending.pop(future)
+                    error = future.exception()
+                    result = None if error is not None else future.result()
+                    yield BatchResult(index, item, result, error)
+                submit(islice(items, len(done)))
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket, limiting the rate of calls.
+
+    The bucket holds up to `capacity` tokens, and is refilled at `rate` tokens per
+    second. Each call takes a token, waiting for it if the bucket is empty, so
+    that calls are made at most at `rate` per second, after an initial burst of
+    `capacity` calls.
+    """
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = capacity
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a token, waiting until one is available."""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            # Reserve the token now, so that waiting callers are served in turn
+            self._tokens -= 1
+            wait_time = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait_time > 0:
+            self.sleep(wait_time)
+
+
+class Checkpoint(object):
+    """
+    Append-only log of the progress of a batch, to resume it after an interruption.
+
+    Each item is marked as pending before it is processed, and as done once it
+    succeeded. When the log is opened again, the items marked as done are known,
+    so that a resumed batch can skip them.
+    """
+
+    def __init__(self, path, codec):
+        """
+        Args:
+            path (str): The path of the log file, created if needed.
+            codec (JSONCodec): Encodes the log entries.
+        """
+        self.path = path
+        self.codec = codec
+        self._done = set()
+        try:
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        state, key = codec.loads(line)
+                    except ValueError:
+                        continue  # Entry truncated by an interruption
+                    if state == 'done':
+                        self._done.add(key)
+        except FileNotFoundError:
+            pass
+        self._file = open(path, 'ab')
+        self._lock = threading.Lock()
+
+    def is_done(self, key):
+        """Returns True if the item was marked as done."""
+        return key in self._done
+
+    def mark_pending(self, key):
+        """Marks an item as being processed."""
+        self._write('pending', key)
+
+    def mark_done(self, key):
+        """Marks an item as successfully processed."""
+        self._write('done', key)
+        self._done.add(key)
+
+    def _write(self, state, key):
+        entry = self.codec.dumps([state, key]) + b'\n'
+        with self._lock:
+            self._file.write(entry)
+            self._file.flush()
+
+    def close(self):
+        """Closes the log file."""
+        self._file.close()
@@ -0,0 +1,92 @@
+"""
+In-process cache of merchant backend orders.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 1024
+
+# Orders that are still waiting for a payment change often, paid ones rarely.
+DEFAULT_TTLS = {
+    'unpaid': 2,
+    'claimed': 5,
+    'paid': 300,
+}
+DEFAULT_TTL = 5
+
+
+class OrderCache(object):
+    """
+    Thread-safe LRU cache of order details, with a time-to-live per order status.
+
+    Entries are evicted in least-recently-used order once `max_size` is reached,
+    and expire after the TTL of the `order_status` they were stored with.
+    Cached dicts are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE, ttls=None, default_ttl=DEFAULT_TTL, clock=time.monotonic):
+        """
+        Args:
+            max_size (int): Maximum number of cached orders.
+            ttls (dict, optional): TTLs in seconds by order status, merged with `DEFAULT_TTLS`.
+            default_ttl (float): TTL in seconds for statuses missing from `ttls`.
+            clock (callable): Returns the current time in seconds.
+        """
+        self.max_size = max_size
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.default_ttl = default_ttl
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # order_id -> (expires_at, order)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds a cache from the `TALER_ORDER_CACHE_*` keys of a Flask config."""
+        return cls(
+            max_size=config.get('TALER_ORDER_CACHE_SIZE', DEFAULT_CACHE_SIZE),
+            ttls=config.get('TALER_ORDER_CACHE_TTLS'),
+            default_ttl=config.get('TALER_ORDER_CACHE_DEFAULT_TTL', DEFAULT_TTL),
+        )
+
+    def get(self, order_id):
+        """Returns the cached order, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(order_id)
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    del self._entries[order_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(order_id)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, order_id, order):
+        """Stores an order, with the TTL of its status."""
+        ttl = self.ttls.get(order.get('order_status'), self.default_ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[order_id] = (self.clock() + ttl, order)
+            self._entries.move_to_end(order_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, order_id):
+        """Drops an order from the cache."""
+        with self._lock:
+            self._entries.pop(order_id, None)
+
+    def clear(self):
+        """Drops all orders from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the hit and miss counters, and the current size of the cache."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
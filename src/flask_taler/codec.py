@@ -0,0 +1,79 @@
+"""
+JSON encoding and decoding, with the fastest available library.
+
+`orjson` and `ujson` are used when installed, and the standard library
+otherwise. A codec encodes to bytes, and decodes bytes directly, without
+decoding them to a string first. Decoding errors are `ValueError`s, whatever
+the library.
+"""
+import json
+
+
+class JSONCodec(object):
+    """
+    A JSON library, behind a common interface.
+
+    Attributes:
+        name (str): The name of the library.
+        dumps (callable): Encodes an object to compact JSON bytes.
+        loads (callable): Decodes JSON bytes or a string. Raises `ValueError` on invalid input.
+    """
+    __slots__ = ('name', 'dumps', 'loads')
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self):
+        return f'<JSONCodec {self.name}>'
+
+
+def _orjson():
+    import orjson
+
+    return JSONCodec('orjson', orjson.dumps, orjson.loads)
+
+
+def _ujson():
+    import ujson
+
+    return JSONCodec('ujson', lambda obj: ujson.dumps(obj, ensure_ascii=False).encode('utf-8'), ujson.loads)
+
+
+def _stdlib():
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    return JSONCodec('json', lambda obj: encoder.encode(obj).encode('utf-8'), json.loads)
+
+
+BACKENDS = {
+    'orjson': _orjson,
+    'ujson': _ujson,
+    'json': _stdlib,
+}
+
+
+def get_codec(backend=None):
+    """
+    Returns a JSON codec.
+
+    Args:
+        backend (str or JSONCodec, optional): `'orjson'`, `'ujson'`, `'json'`, or a codec object.
+            Defaults to the first of these libraries which is installed.
+
+    Raises:
+        ImportError: If the requested library is not installed.
+        ValueError: If the backend is unknown.
+    """
+    if backend is None:
+        for factory in (_orjson, _ujson):
+            try:
+                return factory()
+            except ImportError:
+                pass
+        return _stdlib()
+    if not isinstance(backend, str):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown JSON backend: {backend}")
+    return BACKENDS[backend]()
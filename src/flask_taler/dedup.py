@@ -0,0 +1,114 @@
+"""
+Stores of already processed webhook deliveries, used to drop duplicates.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from . import _sqlite
+
+DEFAULT_DEDUP_SIZE = 10000
+DEFAULT_DEDUP_TTL = 24 * 3600
+
+
+class MemoryDedupStore(object):
+    """
+    Bounded in-process set of delivery keys, with LRU eviction and a time-to-live.
+
+    Only deduplicates deliveries received by the same process.
+    """
+
+    def __init__(self, max_size=DEFAULT_DEDUP_SIZE, ttl=DEFAULT_DEDUP_TTL, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._keys = OrderedDict()  # key -> expires_at
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        """Adds a key. Returns False if it was already present (i.e. a duplicate)."""
+        now = self.clock()
+        with self._lock:
+            expires_at = self._keys.get(key)
+            if expires_at is not None and expires_at > now:
+                return False
+            self._keys[key] = now + self.ttl
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+            return True
+
+    def discard(self, key):
+        """Removes a key, so that the delivery can be processed again."""
+        with self._lock:
+            self._keys.pop(key, None)
+
+
+class SQLiteDedupStore(object):
+    """
+    Set of delivery keys stored in a SQLite database, with a time-to-live.
+
+    The database can be shared by all the worker processes of an application.
+    Expired keys are purged every `purge_every` additions.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_DEDUP_TTL, purge_every=1000):
+        self.path = path
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._additions = 0
+        self._conn = _sqlite.connect(path)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS webhook_deliveries (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+
+    def add(self, key):
+        """Adds a key. Returns False if it was already present (i.e. a duplicate)."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO webhook_deliveries (key, expires_at) VALUES (?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET expires_at = excluded.expires_at"
+                " WHERE webhook_deliveries.expires_at <= ?",
+                (key, now + self.ttl, now),
+            )
+            self._additions += 1
+            if self._additions % self.purge_every == 0:
+                self._conn.execute("DELETE FROM webhook_deliveries WHERE expires_at <= ?", (now,))
+            return cursor.rowcount > 0
+
+    def discard(self, key):
+        """Removes a key, so that the delivery can be processed again."""
+        with self._lock:
+            self._conn.execute("DELETE FROM webhook_deliveries WHERE key = ?", (key,))
+
+
+def dedup_store_from_config(app):
+    """
+    Builds the store of processed webhooks configured by the `TALER_WEBHOOK_DEDUP*` keys.
+
+    Returns None if deduplication is disabled.
+    """
+    config = app.config
+    store = config.get('TALER_WEBHOOK_DEDUP', False)
+    if not store:
+        return None
+    if store is not True:
+        return store  # A custom store, implementing add and discard
+
+    ttl = config.get('TALER_WEBHOOK_DEDUP_TTL', DEFAULT_DEDUP_TTL)
+    path = config.get('TALER_WEBHOOK_DEDUP_PATH')
+    if path:
+        return SQLiteDedupStore(os.path.join(app.instance_path, path), ttl=ttl)
+    return MemoryDedupStore(config.get('TALER_WEBHOOK_DEDUP_SIZE', DEFAULT_DEDUP_SIZE), ttl=ttl)
+
+
+def event_key(event):
+    """Returns the key identifying a webhook event: its ID, or its order ID and type."""
+    if event.get('id'):
+        return f"id:{event['id']}"
+    payload = event.get('payload')
+    if isinstance(payload, dict) and payload.get('order_id'):
+        return f"order:{payload['order_id']}:{event.get('type')}"
+    return None
@@ -0,0 +1,85 @@
+"""
+Table of the merchant backend endpoints, compiled once by `init_app`.
+
+Each operation is described by its HTTP method, path and properties. Compiling
+the table resolves the paths against the backend URL and builds the request
+headers up front, so that a call only concatenates the order ID into the URL.
+"""
+from types import MappingProxyType
+from urllib.parse import urljoin
+
+# operation -> (method, path relative to the backend URL, has_body, idempotent)
+ENDPOINTS = {
+    'create_order': ('POST', 'private/orders', True, False),
+    'list_orders': ('GET', 'private/orders', False, True),
+    'get_order': ('GET', 'private/orders/{order_id}', False, True),
+    'wait_for_payment': ('GET', 'private/orders/{order_id}', False, True),
+    'process_refund': ('POST', 'private/orders/{order_id}/refund', True, False),
+}
+
+
+class Endpoint(object):
+    """
+    A compiled merchant backend endpoint.
+
+    Attributes:
+        operation (str): The operation name, used for timeouts, metrics and traces.
+        method (str): The HTTP method.
+        headers (Mapping): The read-only request headers, shared by all calls.
+        idempotent (bool): True if failed calls can be retried.
+    """
+    __slots__ = ('operation', 'method', 'headers', 'idempotent', '_prefix', '_suffix')
+
+    def __init__(self, operation, method, prefix, suffix, headers, idempotent):
+        self.operation = operation
+        self.method = method
+        self.headers = headers
+        self.idempotent = idempotent
+        self._prefix = prefix
+        self._suffix = suffix  # None if the path does not depend on the order ID
+
+    def url(self, order_id=None):
+        """Returns the URL of the endpoint, for an order if its path has an `{order_id}`."""
+        if self._suffix is None:
+            return self._prefix
+        return f'{self._prefix}{order_id}{self._suffix}'
+
+    def __repr__(self):
+        return f'<Endpoint {self.operation}: {self.method} {self.url("{order_id}")}>'
+
+
+def backend_root(base_url):
+    """Returns the URL the endpoint paths are resolved against: the backend URL, ending with a slash."""
+    return base_url.rstrip('/') + '/'
+
+
+def compile_endpoints(base_url, api_key, endpoints=ENDPOINTS):
+    """
+    Compiles a table of endpoints for a merchant backend.
+
+    Paths are resolved relative to the backend URL, so that the path of an instance
+    (e.g. `https://backend.example.com/instances/shop`) is kept, with or without a
+    trailing slash.
+
+    Args:
+        base_url (str): The merchant backend URL.
+        api_key (str): The merchant backend API key.
+        endpoints (dict, optional): Endpoint descriptions by operation, see `ENDPOINTS`.
+
+    Returns:
+        Mapping: A read-only mapping of operation names to `Endpoint` objects.
+    """
+    headers = {
+        'Accept': 'application/json',
+        'Authorization': f'Basic {api_key}',
+    }
+    read_headers = MappingProxyType(headers)
+    write_headers = MappingProxyType(dict(headers, **{'Content-Type': 'application/json'}))
+
+    base_url = backend_root(base_url)
+    table = {}
+    for operation, (method, path, has_body, idempotent) in endpoints.items():
+        prefix, templated, suffix = path.partition('{order_id}')
+        table[operation] = Endpoint(operation, method, urljoin(base_url, prefix), suffix if templated else None,
+                                    write_headers if has_body else read_headers, idempotent)
+    return MappingProxyType(table)
@@ -0,0 +1,116 @@
+"""
+Logging configuration of the extension.
+
+Log records of the `flask_taler` loggers are put on a queue by the thread that
+emits them, and written to the configured sinks by a background thread, so
+request threads never wait on disk or console I/O.
+"""
+import atexit
+import logging
+import queue
+import reprlib
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+DEFAULT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Bounds the work done to render a payload, whatever its size
+_payload_repr = reprlib.Repr()
+_payload_repr.maxlevel = 4
+_payload_repr.maxdict = 20
+_payload_repr.maxlist = 20
+_payload_repr.maxstring = 200
+_payload_repr.maxother = 200
+
+_listener = None
+_queue_handler = None
+_logger = None
+_lock = threading.Lock()
+
+
+class TruncatedRepr(object):
+    """
+    Log argument rendering an object only when the record is formatted.
+
+    The rendering is bounded in depth and number of items, and truncated to
+    `max_size` characters.
+    """
+    __slots__ = ('obj', 'max_size')
+
+    def __init__(self, obj, max_size=1024):
+        self.obj = obj
+        self.max_size = max_size
+
+    def __str__(self):
+        text = _payload_repr.repr(self.obj)
+        if len(text) > self.max_size:
+            text = text[:self.max_size] + '...'
+        return text
+
+    __repr__ = __str__
+
+
+def build_sinks(config):
+    """
+    Builds the log handlers configured by the `TALER_LOG_*` keys of a Flask config.
+
+    - `TALER_LOG_CONSOLE`: Log to stderr (default: True).
+    - `TALER_LOG_FILE`: Path of a log file (default: none).
+    - `TALER_LOG_HANDLERS`: A list of additional `logging.Handler` objects.
+    - `TALER_LOG_FORMAT`: Format of the console and file records.
+    """
+    formatter = logging.Formatter(config.get('TALER_LOG_FORMAT', DEFAULT_FORMAT))
+    sinks = []
+    if config.get('TALER_LOG_CONSOLE', True):
+        sinks.append(logging.StreamHandler())
+    if config.get('TALER_LOG_FILE'):
+        sinks.append(logging.FileHandler(config['TALER_LOG_FILE'], delay=True))
+    for sink in sinks:
+        sink.setFormatter(formatter)
+    return sinks + list(config.get('TALER_LOG_HANDLERS', ()))
+
+
+def configure_logging(app, logger_name='flask_taler'):
+    """
+    Routes the records of the extension loggers through a queue to the configured sinks.
+
+    Calling this again (e.g. for another app) replaces the previous configuration.
+    """
+    global _listener, _queue_handler, _logger
+
+    logger = logging.getLogger(logger_name)
+    logger.setLevel(app.config.get('TALER_LOG_LEVEL', logging.INFO))
+    sinks = build_sinks(app.config)
+
+    with _lock:
+        _stop()
+        if not sinks:
+            return
+        records = queue.SimpleQueue()
+        _queue_handler = QueueHandler(records)
+        _listener = QueueListener(records, *sinks, respect_handler_level=True)
+        _logger = logger
+        _logger.addHandler(_queue_handler)
+        _listener.start()
+
+
+def stop_logging():
+    """Writes out the queued records, and stops the background logging thread."""
+    with _lock:
+        _stop()
+
+
+def _stop():
+    global _listener, _queue_handler
+    if _queue_handler is not None:
+        _logger.removeHandler(_queue_handler)
+        _queue_handler.close()
+        _queue_handler = None
+    if _listener is not None:
+        _listener.stop()
+        for sink in _listener.handlers:
+            sink.close()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,136 @@
+"""
+Metrics of the calls to the merchant backend, in the Prometheus text format.
+"""
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from flask import Blueprint, Response
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram(object):
+    """Cumulative latency histogram, with fixed bucket boundaries."""
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.counts = [0] * (len(buckets) + 1)  # The last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+
+class Metrics(object):
+    """
+    Thread-safe registry of merchant backend call metrics, by operation.
+
+    Records, for each operation (e.g. `get_order`), a latency histogram, the
+    number of responses by status code, the number of retries and the number
+    of calls in flight. Each update is a few integer operations under a lock,
+    cheap enough to be left on in production.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._histograms = {}
+        self._responses = defaultdict(int)  # (operation, status) -> count
+        self._retries = defaultdict(int)  # operation -> count
+        self._in_flight = defaultdict(int)  # operation -> count
+        self._gauges = {}  # (name, help) -> value
+        self._lock = threading.Lock()
+
+    def begin(self, operation):
+        """Records the start of a call."""
+        with self._lock:
+            self._in_flight[operation] += 1
+
+    def end(self, operation, duration, status):
+        """
+        Records the end of a call.
+
+        Args:
+            operation (str): The operation name.
+            duration (float): The duration of the call, in seconds.
+            status: The HTTP status code, or 'error' if no response was received.
+        """
+        index = bisect_left(self.buckets, duration)
+        with self._lock:
+            self._in_flight[operation] -= 1
+            self._responses[operation, status] += 1
+            histogram = self._histograms.get(operation)
+            if histogram is None:
+                histogram = self._histograms[operation] = Histogram(self.buckets)
+            histogram.counts[index] += 1
+            histogram.sum += duration
+            histogram.count += 1
+
+    def retry(self, operation):
+        """Records a retried call."""
+        with self._lock:
+            self._retries[operation] += 1
+
+    def set_gauge(self, name, value, help_text=''):
+        """
+        Sets the value of a free-form gauge, e.g. the state of a circuit breaker.
+
+        The value can also be a callable, called each time the metrics are rendered.
+        """
+        with self._lock:
+            self._gauges[name] = (value, help_text)
+
+    def render(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            lines = [
+                '# HELP taler_backend_request_duration_seconds Duration of merchant backend calls.',
+                '# TYPE taler_backend_request_duration_seconds histogram',
+            ]
+            for operation, histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'taler_backend_request_duration_seconds_bucket'
+                                 f'{{operation="{operation}",le="{bound}"}} {cumulative}')
+                lines.append(f'taler_backend_request_duration_seconds_sum{{operation="{operation}"}} {histogram.sum}')
+                lines.append(f'taler_backend_request_duration_seconds_count{{operation="{operation}"}} {histogram.count}')
+
+            lines += [
+                '# HELP taler_backend_responses_total Merchant backend calls, by status code.',
+                '# TYPE taler_backend_responses_total counter',
+            ]
+            for (operation, status), count in sorted(self._responses.items(), key=str):
+                lines.append(f'taler_backend_responses_total{{operation="{operation}",status="{status}"}} {count}')
+
+            lines += [
+                '# HELP taler_backend_retries_total Retried merchant backend calls.',
+                '# TYPE taler_backend_retries_total counter',
+            ]
+            for operation, count in sorted(self._retries.items()):
+                lines.append(f'taler_backend_retries_total{{operation="{operation}"}} {count}')
+
+            lines += [
+                '# HELP taler_backend_requests_in_flight Merchant backend calls in progress.',
+                '# TYPE taler_backend_requests_in_flight gauge',
+            ]
+            for operation, count in sorted(self._in_flight.items()):
+                lines.append(f'taler_backend_requests_in_flight{{operation="{operation}"}} {count}')
+
+            for name, (value, help_text) in sorted(self._gauges.items()):
+                if callable(value):
+                    value = value()
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+
+        return '\n'.join(lines) + '\n'
+
+
+def metrics_blueprint(metrics, url):
+    """Returns a blueprint serving the metrics at `url`."""
+    blueprint = Blueprint('taler_metrics', __name__)
+
+    @blueprint.route(url)
+    def taler_metrics():
+        return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+    return blueprint
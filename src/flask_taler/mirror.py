@@ -0,0 +1,271 @@
+"""
+Local SQLite mirror of the merchant backend orders, for reporting.
+
+The mirror is updated incrementally: `sync` lists the orders created since
+the last sync (from a cursor saved in the database), and refreshes the orders
+that webhook events marked as changed. Reads are served from the local
+database, indexed by order ID, status and creation date.
+"""
+import logging
+import threading
+import time
+
+from . import _sqlite
+from .codec import get_codec
+from .models import Order
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS orders ("
+    " order_id TEXT PRIMARY KEY,"
+    " row_id INTEGER,"
+    " status TEXT,"
+    " refunded INTEGER,"
+    " amount TEXT,"
+    " summary TEXT,"
+    " created_at INTEGER,"
+    " stale INTEGER NOT NULL DEFAULT 0,"
+    " synced_at REAL,"
+    " data BLOB)",
+    "CREATE INDEX IF NOT EXISTS orders_status ON orders (status, created_at)",
+    "CREATE INDEX IF NOT EXISTS orders_created_at ON orders (created_at)",
+    "CREATE INDEX IF NOT EXISTS orders_stale ON orders (stale) WHERE stale > 0",
+    "CREATE TABLE IF NOT EXISTS mirror_state (key TEXT PRIMARY KEY, value)",
+)
+
+_COLUMNS = 'order_id, row_id, status, refunded, amount, summary, created_at, stale, data'
+
+
+def _fields(data):
+    """Returns the indexed fields of an order, from a listing entry or the order details."""
+    order = Order(data)
+    status = order.status or ('paid' if order.paid else 'unpaid')
+    refunded = data.get('refunded')
+    created_at = order.creation_time
+    return (status, None if refunded is None else int(refunded), str(order.amount) if order.amount else None,
+            order.summary, int(created_at.timestamp()) if created_at else None)
+
+
+class OrderMirror(object):
+    """
+    SQLite mirror of the orders of a merchant backend.
+
+    The database can be shared by all the worker processes of an application,
+    but `sync` should only run in one of them at a time.
+    """
+
+    def __init__(self, path, codec=None):
+        """
+        Args:
+            path (str): The path of the SQLite database, created if needed.
+            codec (JSONCodec, optional): Encodes the stored order details. Defaults to the fastest
+                JSON library installed.
+        """
+        self.path = path
+        self.codec = codec or get_codec()
+        self._conn = _sqlite.connect(path)
+        self._lock = threading.Lock()
+        for statement in _SCHEMA:
+            self._conn.execute(statement)
+
+        self._sync_thread = None
+        self._stopping = threading.Event()
+
+    @property
+    def cursor(self):
+        """The row ID of the last order listed by `sync`, or None before the first sync."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM mirror_state WHERE key = 'cursor'").fetchone()
+        return row[0] if row else None
+
+    def sync(self, taler, page_size=500):
+        """
+        Brings the mirror up to date with the merchant backend.
+
+        Lists the orders created since the previous sync, then refreshes the details of the
+        orders marked as changed by webhook events.
+
+        Args:
+            taler (Taler): The extension, used to call the backend.
+            page_size (int, optional): Number of orders listed per backend request, and written
+                per transaction.
+
+        Returns:
+            int: The number of orders added or refreshed.
+        """
+        count = 0
+        batch = []
+        for entry in taler.iter_orders(start=self.cursor, page_size=page_size, prefetch=True):
+            batch.append(entry)
+            if len(batch) >= page_size:
+                count += self._add_listed(batch)
+                batch = []
+        if batch:
+            count += self._add_listed(batch)
+        return count + self._refresh_stale(taler, page_size)
+
+    def _add_listed(self, entries):
+        """Adds listed orders, and moves the cursor past them, in a single transaction."""
+        now = time.time()
+        rows = [(entry['order_id'], entry.get('row_id'), *_fields(entry), now, self.codec.dumps(entry))
+                for entry in entries]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO orders (order_id, row_id, status, refunded, amount, summary, created_at,"
+                    " synced_at, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (order_id) DO UPDATE SET row_id = excluded.row_id,"
+                    " status = coalesce(orders.status, excluded.status),"
+                    " amount = coalesce(orders.amount, excluded.amount),"
+                    " summary = coalesce(orders.summary, excluded.summary),"
+                    " created_at = coalesce(orders.created_at, excluded.created_at),"
+                    " data = coalesce(orders.data, excluded.data)",
+                    rows,
+                )
+                self._conn.execute(
+                    "INSERT INTO mirror_state (key, value) VALUES ('cursor', ?)"
+                    " ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                    (entries[-1]['row_id'],),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def _refresh_stale(self, taler, batch_size):
+        """Fetches the details of the orders changed since they were mirrored."""
+        count = 0
+        last_order_id = ''
+        while True:
+            with self._lock:
+                stale = self._conn.execute(
+                    "SELECT order_id, stale FROM orders WHERE stale > 0 AND order_id > ?"
+                    " ORDER BY order_id LIMIT ?", (last_order_id, batch_size)).fetchall()
+            if not stale:
+                return count
+            last_order_id = stale[-1][0]
+
+            updates = []
+            orders = taler.get_orders(order_id for order_id, _ in stale)
+            for order_id, generation in stale:
+                data = orders[order_id]
+                if data is None:
+                    logger.warning("Could not refresh mirrored order %s", order_id)
+                    continue  # Try again at the next sync
+                updates.append((*_fields(data), time.time(), self.codec.dumps(data), generation, order_id))
+
+            # An event received while fetching an order leaves it stale, to be refreshed again
+            with self._lock:
+                self._conn.executemany(
+                    "UPDATE orders SET status = ?, refunded = ?, amount = ?, summary = ?, created_at = ?,"
+                    " synced_at = ?, data = ?, stale = stale - ? WHERE order_id = ?",
+                    updates,
+                )
+            count += len(updates)
+
+    def apply_event(self, event):
+        """
+        Records a webhook event: marks its order as changed, to be refreshed by the next sync.
+
+        If the event payload has an `order_status`, it is applied right away.
+        """
+        payload = event.get('payload')
+        if not isinstance(payload, dict) or not payload.get('order_id'):
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO orders (order_id, status, stale) VALUES (?, ?, 1)"
+                " ON CONFLICT (order_id) DO UPDATE SET status = coalesce(excluded.status, orders.status),"
+                " stale = orders.stale + 1",
+                (payload['order_id'], payload.get('order_status')),
+            )
+
+    def get(self, order_id):
+        """
+        Returns a mirrored order, or None if it is not in the mirror.
+
+        Orders are dicts with the `order_id`, `row_id`, `status`, `refunded`, `amount`, `summary`,
+        `created_at` (timestamp in seconds) and `stale` (True if changed since the last sync) fields,
+        and the last order details received from the backend, under `data`.
+        """
+        with self._lock:
+            row = self._conn.execute(f"SELECT {_COLUMNS} FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+        return self._record(row) if row else None
+
+    def query(self, status=None, since=None, until=None, descending=False, limit=None):
+        """
+        Returns mirrored orders, ordered by creation date.
+
+        Args:
+            status (str, optional): Only return orders with this status, e.g. `'paid'`.
+            since (int, optional): Only return orders created at or after this timestamp, in seconds.
+            until (int, optional): Only return orders created before this timestamp, in seconds.
+            descending (bool, optional): Return the most recent orders first.
+            limit (int, optional): Maximum number of orders returned.
+
+        Returns:
+            list: The orders, as returned by `get`.
+        """
+        conditions, params = [], []
+        for condition, value in (('status = ?', status), ('created_at >= ?', since), ('created_at < ?', until)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        sql = f"SELECT {_COLUMNS} FROM orders"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY created_at DESC" if descending else " ORDER BY created_at"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._record(row) for row in rows]
+
+    def count(self, status=None):
+        """Returns the number of mirrored orders, optionally with a given status."""
+        with self._lock:
+            if status is None:
+                return self._conn.execute("SELECT count(*) FROM orders").fetchone()[0]
+            return self._conn.execute("SELECT count(*) FROM orders WHERE status = ?", (status,)).fetchone()[0]
+
+    def _record(self, row):
+        order_id, row_id, status, refunded, amount, summary, created_at, stale, data = row
+        return {
+            'order_id': order_id,
+            'row_id': row_id,
+            'status': status,
+            'refunded': None if refunded is None else bool(refunded),
+            'amount': amount,
+            'summary': summary,
+            'created_at': created_at,
+            'stale': stale > 0,
+            'data': self.codec.loads(data) if data is not None else None,
+        }
+
+    def start(self, taler, interval, page_size=500):
+        """Starts a daemon thread calling `sync` every `interval` seconds."""
+        if self._sync_thread is not None:
+            return
+        self._stopping.clear()
+        self._sync_thread = threading.Thread(target=self._run, args=(taler, interval, page_size),
+                                             name='taler-order-mirror', daemon=True)
+        self._sync_thread.start()
+
+    def stop(self, timeout=None):
+        """Stops the sync thread, once it is done with its current sync."""
+        self._stopping.set()
+        if self._sync_thread is not None:
+            self._sync_thread.join(timeout)
+            self._sync_thread = None
+
+    def _run(self, taler, interval, page_size):
+        while not self._stopping.is_set():
+            try:
+                self.sync(taler, page_size)
+            except Exception:
+                logger.exception("Error syncing the order mirror")
+            self._stopping.wait(interval)
@@ -0,0 +1,171 @@
+"""
+Read-only models of merchant backend responses.
+"""
+from collections import namedtuple
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from types import MappingProxyType
+
+from .amount import Amount
+
+_EMPTY = MappingProxyType({})
+
+
+class Refund(namedtuple('Refund', ['amount', 'reason', 'timestamp', 'pending'])):
+    """
+    A refund granted on an order.
+
+    Attributes:
+        amount (Amount): The refunded amount.
+        reason (str): The reason given for the refund.
+        timestamp (datetime): When the refund was granted.
+        pending (bool): True if the wallet did not pick up the refund yet.
+    """
+    __slots__ = ()
+
+
+class WireTransfer(namedtuple('WireTransfer', ['wtid', 'exchange_url', 'amount', 'execution_time', 'confirmed'])):
+    """
+    A wire transfer from the exchange, paying the merchant for an order.
+
+    Attributes:
+        wtid (str): The wire transfer identifier.
+        exchange_url (str): The URL of the exchange making the transfer.
+        amount (Amount): The transferred amount.
+        execution_time (datetime): When the exchange executed the transfer.
+        confirmed (bool): True if the merchant confirmed receiving the transfer.
+    """
+    __slots__ = ()
+
+
+class _lazy(object):
+    """Property computed on first access, and stored in the `_<name>` slot of the instance."""
+
+    def __init__(self, func):
+        self.func = func
+        self.slot = f'_{func.__name__}'
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        try:
+            return getattr(obj, self.slot)
+        except AttributeError:
+            value = self.func(obj)
+            setattr(obj, self.slot, value)
+            return value
+
+
+def _amount(value):
+    return Amount.parse(value) if value else None
+
+
+def _timestamp(value):
+    """Converts a Taler protocol timestamp (`{"t_s": seconds}`) to an aware datetime, or None for "never"."""
+    if not isinstance(value, dict) or not isinstance(value.get('t_s'), int):
+        return None
+    return datetime.fromtimestamp(value['t_s'], timezone.utc)
+
+
+class Order(Mapping):
+    """
+    An order, as returned by the merchant backend.
+
+    The order wraps the decoded JSON response without copying it, and remains a read-only
+    mapping of its raw fields (`order['order_status']`). Typed fields, like `amount` or
+    `refunds`, are decoded from the nested sections of the response on first access only,
+    so that holding many orders costs little more than their raw responses.
+    """
+    __slots__ = ('_data', '_amount', '_refund_amount', '_refunds', '_wire_details', '_creation_time')
+
+    def __init__(self, data):
+        self._data = data
+
+    @property
+    def raw(self):
+        """The raw response, which must not be mutated."""
+        return self._data
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __eq__(self, other):
+        if isinstance(other, Order):
+            other = other._data
+        return self._data == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'<Order {self.order_id}: {self.status}>'
+
+    def __reduce__(self):
+        return Order, (self._data,)
+
+    @property
+    def contract_terms(self):
+        """The contract terms of the order, as a read-only mapping (empty before the order is claimed)."""
+        terms = self._data.get('contract_terms')
+        return MappingProxyType(terms) if terms else _EMPTY
+
+    @property
+    def order_id(self):
+        """The ID of the order."""
+        return self._data.get('order_id') or self.contract_terms.get('order_id')
+
+    @property
+    def status(self):
+        """The status of the order: `unpaid`, `claimed` or `paid`."""
+        return self._data.get('order_status')
+
+    @property
+    def paid(self):
+        """True if the order was paid."""
+        return self._data.get('order_status') == 'paid' or self._data.get('paid') is True
+
+    @property
+    def summary(self):
+        """The summary of the order."""
+        return self.contract_terms.get('summary') or self._data.get('summary')
+
+    @_lazy
+    def amount(self):
+        """The total amount of the order, as an `Amount`."""
+        data = self._data
+        return _amount(self.contract_terms.get('amount') or data.get('total_amount') or data.get('amount'))
+
+    @_lazy
+    def refund_amount(self):
+        """The total refunded amount, as an `Amount`, or None if the order was not paid."""
+        return _amount(self._data.get('refund_amount'))
+
+    @_lazy
+    def refunds(self):
+        """The refunds granted on the order, as a tuple of `Refund`."""
+        return tuple(
+            Refund(_amount(refund.get('amount')), refund.get('reason'), _timestamp(refund.get('timestamp')),
+                   refund.get('pending', False))
+            for refund in self._data.get('refund_details') or ()
+        )
+
+    @_lazy
+    def wire_details(self):
+        """The wire transfers paying the merchant for the order, as a tuple of `WireTransfer`."""
+        return tuple(
+            WireTransfer(wire.get('wtid'), wire.get('exchange_url'), _amount(wire.get('amount')),
+                         _timestamp(wire.get('execution_time')), wire.get('confirmed', False))
+            for wire in self._data.get('wire_details') or ()
+        )
+
+    @_lazy
+    def creation_time(self):
+        """When the order was created, as an aware datetime, or None if unknown."""
+        data = self._data
+        return _timestamp(self.contract_terms.get('timestamp') or data.get('creation_time') or data.get('timestamp'))
@@ -0,0 +1,222 @@
+"""
+Durable outbox of merchant backend calls, sent in the background.
+
+Calls which do not need a synchronous answer (e.g. refunds) are appended to a
+SQLite log, which is fast and survives restarts, and a background thread sends
+them to the backend in batches, retrying failures with an exponential backoff.
+"""
+import logging
+import random
+import threading
+import time
+
+import requests
+
+from . import _sqlite
+from .batch import iter_concurrent
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_ATTEMPTS = 10
+DEFAULT_VISIBILITY_TIMEOUT = 300
+
+
+def is_permanent_error(error):
+    """Returns True if retrying a failed call cannot help, e.g. a 4xx response other than 429."""
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return 400 <= status < 500 and status != 429
+    # Network errors and timeouts can be retried, other errors are bugs
+    return not isinstance(error, requests.exceptions.RequestException)
+
+
+class Outbox(object):
+    """
+    Durable log of merchant backend calls, sent by a background thread.
+
+    Each entry is an operation name and its keyword arguments. Entries are claimed
+    in batches of `batch_size`, and sent `concurrency` at a time. Failed entries are
+    retried with an exponential backoff until `max_attempts`; entries which failed
+    for good are kept with the `dead` status, see `failed`. The database can be
+    shared by several processes: an entry is only claimed by one of them at a time,
+    until it is done or `visibility_timeout` seconds have passed.
+    """
+
+    def __init__(self, path, codec, batch_size=DEFAULT_BATCH_SIZE, concurrency=DEFAULT_CONCURRENCY,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, retry_backoff=1.0, retry_backoff_max=300.0,
+                 visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, poll_interval=1.0):
+        self.path = path
+        self.codec = codec
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+
+        self._conn = _sqlite.connect(path)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS taler_outbox ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " operation TEXT NOT NULL,"
+            " payload BLOB NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " status TEXT NOT NULL DEFAULT 'pending',"
+            " next_attempt_at REAL NOT NULL DEFAULT 0,"
+            " claimed_at REAL,"
+            " created_at REAL NOT NULL,"
+            " last_error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS taler_outbox_due ON taler_outbox (status, next_attempt_at)")
+
+    @classmethod
+    def from_config(cls, path, codec, config):
+        """Builds an outbox from the `TALER_OUTBOX_*` keys of a Flask config."""
+        return cls(
+            path, codec,
+            batch_size=config.get('TALER_OUTBOX_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+            concurrency=config.get('TALER_OUTBOX_CONCURRENCY', DEFAULT_CONCURRENCY),
+            max_attempts=config.get('TALER_OUTBOX_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS),
+            retry_backoff=config.get('TALER_OUTBOX_RETRY_BACKOFF', 1.0),
+            retry_backoff_max=config.get('TALER_OUTBOX_RETRY_BACKOFF_MAX', 300.0),
+            poll_interval=config.get('TALER_OUTBOX_POLL_INTERVAL', 1.0),
+        )
+
+    def put(self, operation, kwargs):
+        """Appends a call to the outbox, and returns its entry ID."""
+        payload = self.codec.dumps(kwargs)
+        with self._lock:
+            entry_id = self._conn.execute(
+                "INSERT INTO taler_outbox (operation, payload, created_at) VALUES (?, ?, ?)",
+                (operation, payload, time.time()),
+            ).lastrowid
+        self._wakeup.set()
+        return entry_id
+
+    def _claim(self):
+        """Claims a batch of due entries, as `(entry_id, operation, kwargs, attempts)` tuples."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, operation, payload, attempts FROM taler_outbox"
+                    " WHERE (status = 'pending' AND next_attempt_at <= ?)"
+                    " OR (status = 'processing' AND claimed_at < ?)"
+                    " ORDER BY id LIMIT ?",
+                    (now, now - self.visibility_timeout, self.batch_size),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE taler_outbox SET status = 'processing', claimed_at = ?, attempts = attempts + 1"
+                    " WHERE id = ?",
+                    [(now, row[0]) for row in rows],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(entry_id, operation, self.codec.loads(payload), attempts + 1)
+                for entry_id, operation, payload, attempts in rows]
+
+    def process_batch(self, send):
+        """
+        Sends a batch of due entries.
+
+        Args:
+            send (callable): Called with the operation, the keyword arguments and the attempt
+                number (starting at 1) of each entry. Entries for which it raises are retried,
+                unless the error is permanent (see `is_permanent_error`).
+
+        Returns:
+            int: The number of entries processed.
+        """
+        entries = self._claim()
+        if not entries:
+            return 0
+
+        done, failed = [], []
+        now = time.time()
+        for result in iter_concurrent(lambda entry: send(*entry[1:]), entries, self.concurrency):
+            entry_id, operation, _, attempts = result.item
+            if result.ok:
+                done.append((entry_id,))
+                continue
+            dead = attempts >= self.max_attempts or is_permanent_error(result.error)
+            logger.log(logging.ERROR if dead else logging.WARNING, "Outbox %s call %d failed (attempt %d): %s",
+                       operation, entry_id, attempts, result.error)
+            delay = min(self.retry_backoff_max, self.retry_backoff * 2 ** (attempts - 1)) * random.uniform(0.5, 1)
+            failed.append(('dead' if dead else 'pending', now + delay, str(result.error), entry_id))
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("DELETE FROM taler_outbox WHERE id = ?", done)
+                self._conn.executemany(
+                    "UPDATE taler_outbox SET status = ?, next_attempt_at = ?, last_error = ?, claimed_at = NULL"
+                    " WHERE id = ?",
+                    failed,
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(entries)
+
+    def failed(self, limit=100):
+        """Returns the entries which failed for good, as dicts, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, operation, payload, attempts, last_error, created_at FROM taler_outbox"
+                " WHERE status = 'dead' ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [{'id': entry_id, 'operation': operation, 'kwargs': self.codec.loads(payload), 'attempts': attempts,
+                 'error': error, 'created_at': created_at}
+                for entry_id, operation, payload, attempts, error, created_at in rows]
+
+    def retry_failed(self):
+        """Makes the entries which failed for good pending again. Returns their number."""
+        with self._lock:
+            count = self._conn.execute(
+                "UPDATE taler_outbox SET status = 'pending', attempts = 0, next_attempt_at = 0"
+                " WHERE status = 'dead'").rowcount
+        self._wakeup.set()
+        return count
+
+    def __len__(self):
+        """The number of entries still to be sent."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT count(*) FROM taler_outbox WHERE status IN ('pending', 'processing')").fetchone()[0]
+
+    def start(self, send):
+        """Starts a daemon thread sending the entries with `send` (see `process_batch`)."""
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, args=(send,), name='taler-outbox', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops the background thread, once it is done with its current batch."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self, send):
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            try:
+                if self.process_batch(send):
+                    continue
+            except Exception:
+                logger.exception("Error processing the Taler outbox")
+            # Entries added by this process wake the thread up, others are polled
+            self._wakeup.wait(self.poll_interval)
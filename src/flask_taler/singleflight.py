@@ -0,0 +1,90 @@
+"""
+Coalescing of concurrent identical calls ("single flight").
+"""
+import asyncio
+import threading
+import weakref
+
+
+class _Call(object):
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls made from different threads with the same key.
+
+    The first caller for a key runs the function; callers arriving while it is
+    in flight wait for it and receive the same result (or exception), instead
+    of issuing their own call. Results are not kept once the call completes.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        """Calls `func(*args)`, unless a call with the same key is already in flight."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight(object):
+    """
+    Coalesces concurrent calls made from coroutines with the same key.
+
+    Futures are bound to an event loop, so calls are only coalesced within the
+    same running loop.
+    """
+
+    def __init__(self):
+        self._calls = weakref.WeakKeyDictionary()  # loop -> {key: future}
+
+    async def do(self, key, func, *args):
+        """Awaits `func(*args)`, unless a call with the same key is already in flight."""
+        calls = self._calls.setdefault(asyncio.get_running_loop(), {})
+        future = calls.get(key)
+        if future is not None:
+            # Shield the shared future, so that a cancelled waiter does not cancel the others
+            return await asyncio.shield(future)
+
+        future = calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await func(*args)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Mark as retrieved, even if nobody else was waiting
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del calls[key]
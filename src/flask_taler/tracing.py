@@ -0,0 +1,83 @@
+"""
+Tracing hooks around merchant backend calls and webhook dispatch.
+
+A tracer provides:
+
+- `enabled`: False if the tracer does nothing, so that callers can skip
+  preparing span attributes and propagation headers altogether.
+- `span(name, attributes, kind)`: a context manager opening a span, and yielding
+  an object with a `set_attribute(key, value)` method. The kind is `'client'`
+  for backend calls, and `'internal'` for webhook dispatch.
+- `inject(headers)`: adds the trace context propagation headers of the current
+  span to a dict of outgoing HTTP headers.
+
+`OpenTelemetryTracer` adapts OpenTelemetry, which is not a dependency of the
+extension; any object with the same interface can be used instead.
+"""
+from contextlib import contextmanager
+
+
+class _NoopSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class NoopTracer(object):
+    """Tracer doing nothing, used by default."""
+    enabled = False
+
+    def span(self, name, attributes=None, kind='client'):
+        return _NOOP_SPAN
+
+    def inject(self, headers):
+        pass
+
+
+class OpenTelemetryTracer(object):
+    """Tracer reporting spans to OpenTelemetry, and propagating its context to the backend."""
+    enabled = True
+
+    def __init__(self, tracer=None):
+        """
+        Args:
+            tracer (opentelemetry.trace.Tracer, optional): Defaults to the tracer of the global
+                tracer provider.
+        """
+        from opentelemetry import propagate, trace
+
+        self._tracer = tracer or trace.get_tracer('flask_taler')
+        self._propagate = propagate
+        self._kinds = {kind.name.lower(): kind for kind in trace.SpanKind}
+
+    @contextmanager
+    def span(self, name, attributes=None, kind='client'):
+        with self._tracer.start_as_current_span(name, kind=self._kinds[kind], attributes=attributes) as span:
+            yield span
+
+    def inject(self, headers):
+        self._propagate.inject(headers)
+
+
+def tracer_from_config(config):
+    """
+    Returns the tracer configured by `TALER_TRACER`.
+
+    This is either None (no tracing, the default), `'opentelemetry'`, or a tracer object.
+    """
+    tracer = config.get('TALER_TRACER')
+    if tracer is None:
+        return NoopTracer()
+    if tracer == 'opentelemetry':
+        return OpenTelemetryTracer()
+    return tracer
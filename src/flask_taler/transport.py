@@ -0,0 +1,519 @@
+"""
+HTTP transport shared by all calls to the Taler merchant backend.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .tracing import NoopTracer
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - optional dependency
+    httpx = None
+
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_SIZE = 10
+DEFAULT_ASYNC_POOL_SIZE = 100
+
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_RETRY_BACKOFF = 0.1
+DEFAULT_RETRY_BACKOFF_MAX = 2.0
+
+# Responses worth retrying: the request was not processed, or may succeed later
+RETRY_STATUSES = frozenset((429, 502, 503, 504))
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of calling the merchant backend while the circuit breaker is open."""
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling the merchant backend while it is failing, so that callers fail fast.
+
+    The outcomes of the last `window` calls are recorded. Once at least `min_calls`
+    were made, the circuit opens if the rate of failed calls reaches `failure_rate`,
+    or if the rate of calls slower than `slow_call_duration` reaches `slow_call_rate`.
+    While open, calls are rejected with `CircuitOpenError`. After `reset_timeout`
+    seconds, the circuit is half-open: up to `half_open_calls` probe calls are let
+    through, and the circuit closes if they succeed, or opens again if one fails.
+
+    `allow` returns a token, passed back to `record` with the outcome of the call.
+    Tokens are bound to the state in which the call was allowed, so that calls
+    which finish after a state change (e.g. a slow call allowed before the circuit
+    opened) do not count as probes or as samples of the new state.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_rate=0.5, slow_call_duration=None, slow_call_rate=0.8, window=20,
+                 min_calls=10, reset_timeout=30, half_open_calls=1, clock=time.monotonic):
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+
+        self.state = self.CLOSED
+        self._outcomes = deque(maxlen=window)  # (failed, slow) pairs
+        self._opened_at = 0.0
+        self._probes = 0
+        self._generation = 1  # Incremented on each state change
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds a circuit breaker from the `TALER_CIRCUIT_*` keys of a Flask config."""
+        return cls(
+            failure_rate=config.get('TALER_CIRCUIT_FAILURE_RATE', 0.5),
+            slow_call_duration=config.get('TALER_CIRCUIT_SLOW_CALL_DURATION'),
+            slow_call_rate=config.get('TALER_CIRCUIT_SLOW_CALL_RATE', 0.8),
+            window=config.get('TALER_CIRCUIT_WINDOW', 20),
+            min_calls=config.get('TALER_CIRCUIT_MIN_CALLS', 10),
+            reset_timeout=config.get('TALER_CIRCUIT_RESET_TIMEOUT', 30),
+        )
+
+    def allow(self):
+        """
+        Returns a token if a call may be made, or None if it must be rejected.
+
+        Each allowed call must then be recorded, with its token.
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                if self.clock() - self._opened_at < self.reset_timeout:
+                    return None
+                self._set_state(self.HALF_OPEN)
+                self._probes = 0
+            if self.state == self.HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    return None
+                self._probes += 1
+            return self._generation
+
+    def record(self, token, failed, duration=0.0):
+        """Records the outcome of a call allowed with `token`."""
+        slow = self.slow_call_duration is not None and duration > self.slow_call_duration
+        with self._lock:
+            if token != self._generation:
+                return  # A call allowed before the last state change
+            if self.state == self.HALF_OPEN:
+                self._probes -= 1
+                if failed or slow:
+                    self._open()
+                else:
+                    self._set_state(self.CLOSED)
+                    self._outcomes.clear()
+                return
+
+            self._outcomes.append((failed, slow))
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            failures = sum(outcome[0] for outcome in self._outcomes)
+            slow_calls = sum(outcome[1] for outcome in self._outcomes)
+            if failures >= self.failure_rate * calls or slow_calls >= self.slow_call_rate * calls:
+                self._open()
+
+    def _set_state(self, state):
+        self.state = state
+        self._generation += 1
+
+    def _open(self):
+        self._set_state(self.OPEN)
+        self._opened_at = self.clock()
+        self._outcomes.clear()
+
+    def state_value(self):
+        """Returns the state as a number, for metrics: 0 (closed), 1 (half-open) or 2 (open)."""
+        return (self.CLOSED, self.HALF_OPEN, self.OPEN).index(self.state)
+
+
+class RetryBudget(object):
+    """
+    Limits retries to a fraction of the requests, so that they cannot amplify an outage.
+
+    Each request deposits `ratio` tokens, and each retry withdraws one. On top of that,
+    `min_per_second` retries per second are always allowed, so that retries still work
+    at low traffic. Unused tokens accumulate up to `max_tokens`, which is also
+    the initial balance.
+    """
+
+    def __init__(self, ratio=0.1, min_per_second=1.0, max_tokens=10, clock=time.monotonic):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.clock = clock
+        self._tokens = float(max_tokens)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount):
+        now = self.clock()
+        self._tokens = min(self.max_tokens,
+                           self._tokens + amount + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        """Records a request."""
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self):
+        """Returns True if a retry is allowed, and records it."""
+        with self._lock:
+            self._refill(0)
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class Transport(object):
+    """
+    Pooled, keep-alive HTTP transport for the Taler merchant backend.
+
+    A single `HTTPAdapter` (and therefore a single urllib3 connection pool) is
+    shared by every thread, so TCP and TLS connections to the backend are
+    reused across requests. Each thread gets its own lightweight
+    `requests.Session` mounting that adapter, because sessions carry mutable
+    state (cookies, hooks) that is not safe to share between threads.
+
+    The async API uses `httpx.AsyncClient` (optional dependency). An async
+    client is bound to the event loop it was created in, and Flask runs each
+    `async def` view in its own loop, so one client (and pool) is kept per
+    running loop.
+
+    If `metrics` is set, every call is recorded under its operation name, and
+    every call is traced by `tracer`, which does nothing by default.
+
+    Every request has a connect and a read timeout. Idempotent requests are
+    retried after connection errors, timeouts and `RETRY_STATUSES` responses,
+    with an exponential backoff with full jitter, within a `RetryBudget`.
+
+    If `breaker` is set, calls go through that `CircuitBreaker`.
+    """
+
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_size=DEFAULT_POOL_SIZE,
+                 pool_block=False, keep_alive=True, async_pool_size=DEFAULT_ASYNC_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT, timeouts=None,
+                 max_retries=DEFAULT_MAX_RETRIES, retry_backoff=DEFAULT_RETRY_BACKOFF,
+                 retry_backoff_max=DEFAULT_RETRY_BACKOFF_MAX, retry_budget=None):
+        """
+        Args:
+            pool_connections (int): Number of per-host connection pools to cache.
+            pool_size (int): Maximum number of connections kept open per host.
+            pool_block (bool): Block when the pool is exhausted instead of opening extra,
+                non-pooled connections.
+            keep_alive (bool): Keep connections open between requests.
+            async_pool_size (int): Maximum number of concurrent connections of each async client.
+            connect_timeout (float): Default connection timeout, in seconds.
+            read_timeout (float): Default read timeout, in seconds.
+            timeouts (dict, optional): `(connect, read)` timeouts by operation name.
+            max_retries (int): Maximum number of retries of an idempotent request.
+            retry_backoff (float): Base of the exponential backoff between retries, in seconds.
+            retry_backoff_max (float): Maximum backoff between retries, in seconds.
+            retry_budget (RetryBudget, optional): Shared limit on the number of retries.
+        """
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_size,
+                                   pool_block=pool_block)
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self._local = threading.local()
+
+        self.async_pool_size = async_pool_size
+        self._async_client_options = {}
+        self._async_clients = {}  # loop -> (client, closer)
+        self._async_lock = threading.Lock()
+
+        self.metrics = None
+        self.tracer = NoopTracer()
+
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.timeouts = dict(timeouts or {})
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.retry_budget = retry_budget or RetryBudget()
+        self.breaker = None
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds a transport from the `TALER_HTTP_*` keys of a Flask config."""
+        return cls(
+            pool_connections=config.get('TALER_HTTP_POOL_CONNECTIONS', DEFAULT_POOL_CONNECTIONS),
+            pool_size=config.get('TALER_HTTP_POOL_SIZE', DEFAULT_POOL_SIZE),
+            pool_block=config.get('TALER_HTTP_POOL_BLOCK', False),
+            keep_alive=config.get('TALER_HTTP_KEEP_ALIVE', True),
+            async_pool_size=config.get('TALER_HTTP_ASYNC_POOL_SIZE', DEFAULT_ASYNC_POOL_SIZE),
+            connect_timeout=config.get('TALER_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT),
+            read_timeout=config.get('TALER_READ_TIMEOUT', DEFAULT_READ_TIMEOUT),
+            timeouts=config.get('TALER_TIMEOUTS'),
+            max_retries=config.get('TALER_MAX_RETRIES', DEFAULT_MAX_RETRIES),
+            retry_backoff=config.get('TALER_RETRY_BACKOFF', DEFAULT_RETRY_BACKOFF),
+            retry_backoff_max=config.get('TALER_RETRY_BACKOFF_MAX', DEFAULT_RETRY_BACKOFF_MAX),
+            retry_budget=RetryBudget(
+                ratio=config.get('TALER_RETRY_BUDGET_RATIO', 0.1),
+                min_per_second=config.get('TALER_RETRY_BUDGET_MIN_PER_SECOND', 1.0),
+            ),
+        )
+
+    def timeout_for(self, operation):
+        """Returns the `(connect, read)` timeouts of an operation."""
+        return self.timeouts.get(operation, (self.connect_timeout, self.read_timeout))
+
+    def backoff(self, attempt):
+        """Returns the delay before a retry: exponential, with full jitter."""
+        return random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * 2 ** attempt))
+
+    def _should_retry(self, attempt, operation):
+        if attempt >= self.max_retries or not self.retry_budget.withdraw():
+            return False
+        if self.metrics is not None:
+            self.metrics.retry(operation)
+        return True
+
+    @property
+    def session(self):
+        """The `requests.Session` of the current thread, bound to the shared pool."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', self.adapter)
+            session.mount('http://', self.adapter)
+            if not self.keep_alive:
+                session.headers['Connection'] = 'close'
+            self._local.session = session
+        return session
+
+    def request(self, method, url, operation='other', order_id=None, idempotent=False, **kwargs):
+        """
+        Sends a request through the pooled session and returns the response.
+
+        Args:
+            method (str): The HTTP method.
+            url (str): The URL.
+            operation (str): The operation name, used for metrics, tracing and timeouts.
+            order_id (str, optional): The order concerned, added to the trace.
+            idempotent (bool): Whether the request can safely be retried.
+            **kwargs: Passed to `requests.Session.request`.
+
+        The response has an `attempts` attribute: the number of requests sent, retries included.
+        """
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout_for(operation)
+        if not self.tracer.enabled:
+            return self._send_with_retries(method, url, operation, idempotent, kwargs)
+
+        with self.tracer.span(f'taler.{operation}', _span_attributes(method, url, operation, order_id),
+                              kind='client') as span:
+            _inject_trace_headers(self.tracer, kwargs)
+            response = self._send_with_retries(method, url, operation, idempotent, kwargs)
+            span.set_attribute('http.response.status_code', response.status_code)
+            return response
+
+    def _send_with_retries(self, method, url, operation, idempotent, kwargs):
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                response = self._send(method, url, operation, kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if not idempotent or not self._should_retry(attempt, operation):
+                    raise
+            else:
+                if (not idempotent or response.status_code not in RETRY_STATUSES
+                        or not self._should_retry(attempt, operation)):
+                    response.attempts = attempt + 1
+                    return response
+                response.close()
+            attempt += 1
+            time.sleep(self.backoff(attempt))
+
+    def _send(self, method, url, operation, kwargs):
+        breaker = self.breaker
+        if breaker is not None:
+            token = breaker.allow()
+            if token is None:
+                raise CircuitOpenError(f"Circuit breaker open, not calling {url}")
+
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.begin(operation)
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = self.session.request(method, url, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            duration = time.perf_counter() - started
+            if metrics is not None:
+                metrics.end(operation, duration, status)
+            if breaker is not None:
+                _record_outcome(breaker, token, status, duration, kwargs)
+
+    async def async_client(self):
+        """
+        Returns the `httpx.AsyncClient` of the running event loop.
+
+        The client is closed when the loop shuts down its async generators, as
+        `asyncio.run` does, so that each loop (e.g. one per Flask `async def` view)
+        does not leave its client and connections behind.
+        """
+        if httpx is None:
+            raise RuntimeError("The async Taler API requires httpx: pip install 'flask-taler[async]'")
+
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            entry = self._async_clients.get(loop)
+            if entry is not None:
+                return entry[0]
+            # Loops closed without shutting down their async generators cannot close their client
+            for closed_loop in [other for other in self._async_clients if other.is_closed()]:
+                del self._async_clients[closed_loop]
+
+            keepalive = self.async_pool_size if self.keep_alive else 0
+            limits = httpx.Limits(max_connections=self.async_pool_size, max_keepalive_connections=keepalive)
+            client = httpx.AsyncClient(limits=limits, timeout=None, **self._async_client_options)
+            closer = self._close_on_shutdown(loop, client)
+            self._async_clients[loop] = (client, closer)
+        # Starting the generator registers it with the loop, which finalizes it on shutdown
+        await closer.__anext__()
+        return client
+
+    async def _close_on_shutdown(self, loop, client):
+        try:
+            yield
+        finally:
+            with self._async_lock:
+                if self._async_clients.get(loop, (None,))[0] is client:
+                    del self._async_clients[loop]
+            await client.aclose()
+
+    async def async_request(self, method, url, operation='other', order_id=None, idempotent=False, **kwargs):
+        """
+        Sends a request through the async client of the running loop.
+
+        Takes the same arguments as `request`. Transport errors are re-raised as their
+        `requests` counterparts, so that sync and async callers handle a single family
+        of exceptions.
+        """
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout_for(operation)
+        if not self.tracer.enabled:
+            return await self._async_send_with_retries(method, url, operation, idempotent, kwargs)
+
+        with self.tracer.span(f'taler.{operation}', _span_attributes(method, url, operation, order_id),
+                              kind='client') as span:
+            _inject_trace_headers(self.tracer, kwargs)
+            response = await self._async_send_with_retries(method, url, operation, idempotent, kwargs)
+            span.set_attribute('http.response.status_code', response.status_code)
+            return response
+
+    async def _async_send_with_retries(self, method, url, operation, idempotent, kwargs):
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                response = await self._async_send(method, url, operation, kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if not idempotent or not self._should_retry(attempt, operation):
+                    raise
+            else:
+                if (not idempotent or response.status_code not in RETRY_STATUSES
+                        or not self._should_retry(attempt, operation)):
+                    response.attempts = attempt + 1
+                    return response
+                await response.aclose()
+            attempt += 1
+            await asyncio.sleep(self.backoff(attempt))
+
+    async def _async_send(self, method, url, operation, kwargs):
+        client = await self.async_client()
+        connect, read = kwargs['timeout']
+        kwargs = dict(kwargs, timeout=httpx.Timeout(read, connect=connect))
+
+        breaker = self.breaker
+        if breaker is not None:
+            token = breaker.allow()
+            if token is None:
+                raise CircuitOpenError(f"Circuit breaker open, not calling {url}")
+
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.begin(operation)
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = await client.request(method, url, **kwargs)
+            status = response.status_code
+            return response
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        finally:
+            duration = time.perf_counter() - started
+            if metrics is not None:
+                metrics.end(operation, duration, status)
+            if breaker is not None:
+                _record_outcome(breaker, token, status, duration, kwargs)
+
+    def close(self):
+        """Closes all pooled connections."""
+        self.adapter.close()
+
+    async def aclose(self):
+        """Closes the async client of the running event loop, if any."""
+        with self._async_lock:
+            entry = self._async_clients.get(asyncio.get_running_loop())
+        if entry is not None:
+            await entry[1].aclose()
+
+
+def _record_outcome(breaker, token, status, duration, kwargs):
+    failed = status == 'error' or status >= 500
+    if 'timeout_ms' in (kwargs.get('params') or {}):
+        duration = 0.0  # Long polling calls are slow by design
+    breaker.record(token, failed, duration)
+
+
+def _span_attributes(method, url, operation, order_id):
+    attributes = {
+        'http.request.method': method,
+        'url.full': url,
+        'taler.operation': operation,
+    }
+    if order_id is not None:
+        attributes['taler.order_id'] = order_id
+    return attributes
+
+
+def _inject_trace_headers(tracer, kwargs):
+    headers = dict(kwargs.get('headers') or {})
+    tracer.inject(headers)
+    kwargs['headers'] = headers
+
+
+def raise_for_status(response):
+    """
+    Raises `requests.HTTPError` for 4xx and 5xx responses.
+
+    Works for both `requests` and `httpx` responses.
+    """
+    if response.status_code >= 400:
+        raise requests.exceptions.HTTPError(
+            f"{response.status_code} Error for url: {response.url}", response=response)
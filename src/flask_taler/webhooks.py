@@ -0,0 +1,374 @@
+"""
+Background processing of Taler webhooks.
+
+In async mode, `Taler.handle_webhook` only verifies the signature of a webhook
+and puts its raw payload on a queue, so the backend gets its response
+immediately. A pool of worker threads then takes payloads from the queue and
+processes them.
+"""
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+from flask import copy_current_request_context, current_app, has_app_context, has_request_context
+
+from . import _sqlite
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_VISIBILITY_TIMEOUT = 300
+
+
+class HandlerStats(object):
+    """Timing statistics of a webhook handler."""
+    __slots__ = ('calls', 'errors', 'total_time', 'max_time')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_time': self.total_time,
+            'max_time': self.max_time,
+            'mean_time': self.total_time / self.calls if self.calls else 0.0,
+        }
+
+
+class HandlerRegistry(object):
+    """
+    Registry of webhook event handlers, indexed by event type.
+
+    Several handlers can be registered for the same type; handlers registered
+    for `'*'` receive all events. Each call of a handler is timed, and calls
+    slower than `slow_threshold` seconds are logged as warnings.
+    """
+
+    def __init__(self, parallel=False, max_workers=4, slow_threshold=None):
+        """
+        Args:
+            parallel (bool): Run the handlers of an event concurrently, in a thread pool, in the
+                Flask request or app context of the dispatch. Handlers must then be independent
+                of each other.
+            max_workers (int): Size of the thread pool used in parallel mode.
+            slow_threshold (float, optional): Duration, in seconds, above which a handler
+                call is logged as slow.
+        """
+        self.parallel = parallel
+        self.max_workers = max_workers
+        self.slow_threshold = slow_threshold
+        self._handlers = defaultdict(list)
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self._executor = None
+
+    def register(self, event_type, func):
+        """Registers `func` to be called with each event of type `event_type`."""
+        self._handlers[event_type].append(func)
+        return func
+
+    def handlers_for(self, event_type):
+        """Returns the handlers to call for an event type."""
+        return self._handlers.get(event_type, []) + self._handlers.get('*', [])
+
+    def dispatch(self, event):
+        """
+        Calls the handlers registered for the type of an event.
+
+        All handlers are called even if one of them fails; the first exception raised
+        is then re-raised, so that the event can be retried.
+
+        Returns:
+            int: The number of handlers called.
+        """
+        handlers = self.handlers_for(event.get('type'))
+        if self.parallel and len(handlers) > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='taler-handler')
+            call = _in_flask_context(self._call)
+            futures = [self._executor.submit(call, handler, event) for handler in handlers]
+            errors = [future.result() for future in futures]
+        else:
+            errors = [self._call(handler, event) for handler in handlers]
+
+        for error in errors:
+            if error is not None:
+                raise error
+        return len(handlers)
+
+    def _call(self, handler, event):
+        """Calls a handler, records its duration, and returns the exception it raised, if any."""
+        error = None
+        started = time.perf_counter()
+        try:
+            handler(event)
+        except Exception as e:
+            logger.exception("Error in Taler webhook handler %s", _handler_name(handler))
+            error = e
+        elapsed = time.perf_counter() - started
+
+        name = _handler_name(handler)
+        with self._stats_lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = HandlerStats()
+            stats.calls += 1
+            stats.errors += error is not None
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+
+        if self.slow_threshold is not None and elapsed > self.slow_threshold:
+            logger.warning("Slow Taler webhook handler %s: %.3fs for %s event",
+                           name, elapsed, event.get('type'))
+        return error
+
+    def stats(self):
+        """Returns the timing statistics of each handler, by handler name."""
+        with self._stats_lock:
+            return {name: stats.as_dict() for name, stats in self._stats.items()}
+
+
+def _in_flask_context(func):
+    """Wraps a function to run in the current Flask request or app context, from another thread."""
+    if has_request_context():
+        return copy_current_request_context(func)
+    if not has_app_context():
+        return func
+    app = current_app._get_current_object()
+
+    def wrapper(*args, **kwargs):
+        with app.app_context():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _handler_name(handler):
+    return f"{getattr(handler, '__module__', '?')}.{getattr(handler, '__qualname__', repr(handler))}"
+
+
+class MemoryQueue(object):
+    """
+    Bounded in-process webhook queue.
+
+    Payloads are lost if the process stops before they are processed.
+    """
+
+    def __init__(self, max_size=DEFAULT_QUEUE_SIZE):
+        self._queue = queue.Queue(max_size)
+        self._ids = count()
+
+    def put(self, payload):
+        """Adds a payload to the queue. Raises `queue.Full` if the queue is full."""
+        self._queue.put_nowait((next(self._ids), payload))
+
+    def get(self, timeout=None):
+        """Returns the next `(item_id, payload)` pair, or None after `timeout` seconds."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def ack(self, item_id):
+        """Marks an item as processed."""
+
+    def fail(self, item_id):
+        """Marks an item as failed. Failed payloads are dropped."""
+
+    def __len__(self):
+        return self._queue.qsize()
+
+
+class SQLiteQueue(object):
+    """
+    Durable webhook queue, stored in a SQLite database.
+
+    Payloads survive restarts, and the database can be shared by several worker
+    processes. An item is claimed while it is processed; it is made available
+    again if it fails, after an exponential backoff, or if it is not acknowledged
+    within `visibility_timeout` seconds (e.g. because the process died), until
+    `max_attempts` is reached.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_QUEUE_SIZE, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, poll_interval=0.5, retry_backoff=1.0,
+                 retry_backoff_max=300.0):
+        self.path = path
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+
+        self._conn = _sqlite.connect(path)
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS webhook_queue ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " payload BLOB NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL DEFAULT 0,"
+            " claimed_at REAL,"
+            " status TEXT NOT NULL DEFAULT 'pending')"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS webhook_queue_status ON webhook_queue (status, id)")
+
+    def put(self, payload):
+        """Adds a payload to the queue. Raises `queue.Full` if the queue is full."""
+        with self._lock:
+            if self.max_size and self._count() >= self.max_size:
+                raise queue.Full
+            self._conn.execute("INSERT INTO webhook_queue (payload) VALUES (?)", (payload,))
+            self._not_empty.notify()
+
+    def get(self, timeout=None):
+        """Claims the next `(item_id, payload)` pair, or returns None after `timeout` seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while True:
+                item = self._claim()
+                if item is not None:
+                    return item
+                remaining = self.poll_interval if deadline is None else deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                # Also poll, since other processes may add items to the database
+                self._not_empty.wait(min(remaining, self.poll_interval))
+
+    def _claim(self):
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Items which timed out on their last attempt are not claimed again
+            self._conn.execute(
+                "UPDATE webhook_queue SET status = 'dead', claimed_at = NULL"
+                " WHERE status = 'processing' AND claimed_at < ? AND attempts >= ?",
+                (now - self.visibility_timeout, self.max_attempts),
+            )
+            row = self._conn.execute(
+                "SELECT id, payload FROM webhook_queue"
+                " WHERE (status = 'pending' AND next_attempt_at <= ?)"
+                " OR (status = 'processing' AND claimed_at < ?)"
+                " ORDER BY id LIMIT 1",
+                (now, now - self.visibility_timeout),
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE webhook_queue SET status = 'processing', claimed_at = ?, attempts = attempts + 1"
+                    " WHERE id = ?",
+                    (now, row[0]),
+                )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        return None if row is None else (row[0], bytes(row[1]))
+
+    def ack(self, item_id):
+        """Removes a processed item from the queue."""
+        with self._lock:
+            self._conn.execute("DELETE FROM webhook_queue WHERE id = ?", (item_id,))
+
+    def fail(self, item_id):
+        """Releases a failed item for a retry after a backoff, or marks it as dead after `max_attempts`."""
+        with self._lock:
+            row = self._conn.execute("SELECT attempts FROM webhook_queue WHERE id = ?", (item_id,)).fetchone()
+            if row is None:
+                return
+            attempts = row[0]
+            delay = min(self.retry_backoff_max, self.retry_backoff * 2 ** (attempts - 1)) * random.uniform(0.5, 1)
+            self._conn.execute(
+                "UPDATE webhook_queue SET claimed_at = NULL, next_attempt_at = ?, status = ? WHERE id = ?",
+                (time.time() + delay, 'dead' if attempts >= self.max_attempts else 'pending', item_id),
+            )
+
+    def _count(self):
+        return self._conn.execute(
+            "SELECT count(*) FROM webhook_queue WHERE status IN ('pending', 'processing')").fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._count()
+
+
+class WorkerPool(object):
+    """
+    Pool of daemon threads processing the payloads of a webhook queue.
+    """
+
+    def __init__(self, webhook_queue, process, workers=DEFAULT_WORKERS):
+        """
+        Args:
+            webhook_queue: The queue to consume.
+            process (callable): Called with each raw payload.
+            workers (int): Number of worker threads.
+        """
+        self.queue = webhook_queue
+        self.process = process
+        self.workers = workers
+        self._threads = []
+        self._stopping = threading.Event()
+
+    def start(self):
+        """Starts the worker threads."""
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"taler-webhook-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Stops the worker threads, once they are done with their current payload."""
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stopping.is_set():
+            item = self.queue.get(timeout=0.5)
+            if item is None:
+                continue
+            item_id, payload = item
+            try:
+                self.process(payload)
+            except Exception:
+                logger.exception("Error processing Taler webhook")
+                self.queue.fail(item_id)
+            else:
+                self.queue.ack(item_id)
+
+
+def queue_from_config(app):
+    """
+    Builds the webhook queue configured by `TALER_WEBHOOK_QUEUE`.
+
+    This is either `'memory'` (the default), `'sqlite'`, or a queue object
+    implementing `put`, `get`, `ack` and `fail`.
+    """
+    config = app.config
+    backend = config.get('TALER_WEBHOOK_QUEUE', 'memory')
+    max_size = config.get('TALER_WEBHOOK_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)
+    if backend == 'memory':
+        return MemoryQueue(max_size)
+    if backend == 'sqlite':
+        path = os.path.join(app.instance_path, config.get('TALER_WEBHOOK_QUEUE_PATH') or 'taler_webhooks.sqlite3')
+        return SQLiteQueue(path, max_size=max_size,
+                           max_attempts=config.get('TALER_WEBHOOK_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS),
+                           retry_backoff=config.get('TALER_WEBHOOK_RETRY_BACKOFF', 1.0),
+                           retry_backoff_max=config.get('TALER_WEBHOOK_RETRY_BACKOFF_MAX', 300.0))
+    return backend
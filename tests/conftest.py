@@ -0,0 +1,31 @@
+import hashlib
+import hmac
+import json
+
+import pytest
+from flask import Flask
+
+from flask_taler import Taler
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__, instance_path=str(tmp_path))
+    app.config['TESTING'] = True
+    app.config['TALER_EXCHANGE_URL'] = 'https://taler.example.com'
+    app.config['TALER_MERCHANT_BACKEND_URL'] = 'https://merchant.taler.example.com'
+    app.config['TALER_MERCHANT_API_KEY'] = 'test_api_key'
+    return app
+
+
+@pytest.fixture
+def taler(app):
+    return Taler(app)
+
+
+def post_webhook(app, event, secret='webhook-secret'):
+    """Returns a request context for a signed webhook delivery of `event`."""
+    data = json.dumps(event).encode('utf-8')
+    signature = hmac.new(secret.encode('utf-8'), data, hashlib.sha256).hexdigest()
+    return app.test_request_context('/webhook', method='POST', data=data,
+                                    headers={'X-Taler-Signature': signature})
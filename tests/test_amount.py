@@ -0,0 +1,71 @@
+import pickle
+from decimal import Decimal
+
+import pytest
+
+from flask_taler import Amount
+
+
+def test_parse_and_format():
+    amount = Amount.parse('EUR:10.25')
+    assert (amount.currency, amount.value, amount.fraction) == ('EUR', 10, 25000000)
+    assert str(amount) == 'EUR:10.25'
+    assert str(Amount.parse('KUDOS:3')) == 'KUDOS:3'
+    assert str(Amount.parse('EUR:0.00000001')) == 'EUR:0.00000001'
+    assert str(Amount.parse('EUR:1.50')) == 'EUR:1.5'
+
+
+@pytest.mark.parametrize('text', ['EUR', 'EUR:', ':1', 'EUR:1.', 'EUR:.5', 'EUR:-1', 'EUR:1.123456789',
+                                  'EUR:1e3', 'EUR:1.5 ', 'EUR:١', 'CURRENCYTOOLONG:1'])
+def test_parse_invalid(text):
+    with pytest.raises(ValueError):
+        Amount.parse(text)
+
+
+def test_coerce():
+    assert str(Amount.coerce(0.1 + 0.2, 'EUR')) == 'EUR:0.3'
+    assert str(Amount.coerce(10.0, 'EUR')) == 'EUR:10'
+    assert str(Amount.coerce(3, 'EUR')) == 'EUR:3'
+    assert str(Amount.coerce(Decimal('2.125'), 'EUR')) == 'EUR:2.125'
+    assert str(Amount.coerce('CHF:1', 'CHF')) == 'CHF:1'
+    assert str(Amount.coerce('10.00', 'EUR')) == 'EUR:10'
+    assert str(Amount.coerce('0.125', 'EUR')) == 'EUR:0.125'
+    with pytest.raises(ValueError):
+        Amount.coerce('ten', 'EUR')
+    with pytest.raises(ValueError):
+        Amount.coerce('10.00')
+    with pytest.raises(ValueError):
+        Amount.coerce('CHF:1', 'EUR')
+    with pytest.raises(ValueError):
+        Amount.coerce(1.5)
+    with pytest.raises(ValueError):
+        Amount.coerce(-1, 'EUR')
+    with pytest.raises(ValueError):
+        Amount.coerce(float('nan'), 'EUR')
+
+
+def test_arithmetic_and_comparison():
+    a = Amount.parse('EUR:0.1')
+    assert a * 3 == Amount.parse('EUR:0.3')
+    assert a + Amount.parse('EUR:0.95') == Amount('EUR', 1, 5000000)
+    assert Amount.parse('EUR:1') - a == Amount.parse('EUR:0.9')
+    assert a < Amount.parse('EUR:0.2') <= Amount.parse('EUR:0.2')
+    assert not Amount('EUR') and a
+    assert len({a, Amount.parse('EUR:0.10')}) == 1
+    with pytest.raises(ValueError):
+        a - Amount.parse('EUR:1')
+    with pytest.raises(ValueError):
+        a + Amount.parse('CHF:1')
+    with pytest.raises(AttributeError):
+        a.value = 2
+    assert pickle.loads(pickle.dumps(a)) == a
+
+
+def test_sum():
+    orders = [{'amount': 'EUR:0.1'}] * 10 + [{'amount': Amount.parse('EUR:1.05')}]
+    assert str(Amount.sum(order['amount'] for order in orders)) == 'EUR:2.05'
+    assert Amount.sum([], 'EUR') == Amount('EUR')
+    with pytest.raises(ValueError):
+        Amount.sum([])
+    with pytest.raises(ValueError):
+        Amount.sum(['EUR:1', 'CHF:1'])
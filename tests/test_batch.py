@@ -0,0 +1,48 @@
+from flask_taler.batch import Checkpoint, TokenBucket, iter_concurrent
+from flask_taler.codec import get_codec
+
+
+def test_iter_concurrent():
+    def invert(x):
+        return 1 / x
+
+    results = sorted(iter_concurrent(invert, [1, 0, 4], concurrency=2))
+    assert [(result.index, result.result) for result in results] == [(0, 1.0), (1, None), (2, 0.25)]
+    assert isinstance(results[1].error, ZeroDivisionError)
+
+
+def test_token_bucket():
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+
+    bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0], sleep=sleep)
+    for _ in range(4):
+        bucket.acquire()
+    assert sleeps == [0.5, 1.0]  # A burst of 2 calls, then one call every 0.5s
+
+    now[0] = 10
+    sleeps.clear()
+    bucket.acquire()
+    assert sleeps == []
+
+
+def test_checkpoint(tmp_path):
+    path = str(tmp_path / 'refunds.log')
+    codec = get_codec()
+    checkpoint = Checkpoint(path, codec)
+    checkpoint.mark_pending('o1')
+    checkpoint.mark_done('o1')
+    checkpoint.mark_pending('o2')
+    assert checkpoint.is_done('o1')
+    checkpoint.close()
+
+    with open(path, 'ab') as f:
+        f.write(b'["done", "o')  # Interrupted while writing
+
+    checkpoint = Checkpoint(path, codec)
+    assert checkpoint.is_done('o1')
+    assert not checkpoint.is_done('o2')
+    checkpoint.close()
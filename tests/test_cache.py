@@ -0,0 +1,40 @@
+from flask_taler.cache import OrderCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_depends_on_order_status():
+    clock = FakeClock()
+    cache = OrderCache(ttls={'paid': 100, 'unpaid': 1}, clock=clock)
+    cache.set('a', {'order_status': 'paid'})
+    cache.set('b', {'order_status': 'unpaid'})
+
+    clock.now = 10
+    assert cache.get('a') == {'order_status': 'paid'}
+    assert cache.get('b') is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+
+def test_lru_eviction():
+    cache = OrderCache(max_size=2)
+    cache.set('a', {'order_status': 'paid'})
+    cache.set('b', {'order_status': 'paid'})
+    cache.get('a')
+    cache.set('c', {'order_status': 'paid'})
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+
+
+def test_invalidate():
+    cache = OrderCache()
+    cache.set('a', {'order_status': 'paid'})
+    cache.invalidate('a')
+    assert cache.get('a') is None
@@ -0,0 +1,43 @@
+import importlib.util
+
+import pytest
+
+from flask_taler import Taler
+from flask_taler.codec import get_codec
+
+BACKENDS = [name for name in ('orjson', 'ujson', 'json') if importlib.util.find_spec(name)]
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_codec_round_trip(backend):
+    codec = get_codec(backend)
+    data = codec.dumps({'summary': 'Café', 'amount': 'EUR:1.5', 'items': [1, None, True]})
+    assert isinstance(data, bytes)
+    assert codec.loads(data) == {'summary': 'Café', 'amount': 'EUR:1.5', 'items': [1, None, True]}
+    assert codec.loads(data.decode('utf-8')) == codec.loads(data)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('data', [b'{"order_id": ', b'\xff\xfe', b''])
+def test_codec_errors_are_value_errors(backend, data):
+    with pytest.raises(ValueError):
+        get_codec(backend).loads(data)
+
+
+def test_default_codec_is_the_fastest_installed():
+    assert get_codec().name == BACKENDS[0]
+    with pytest.raises(ValueError):
+        get_codec('simplejson')
+
+
+def test_configured_codec(app, requests_mock):
+    app.config['TALER_JSON_BACKEND'] = 'json'
+    taler = Taler(app)
+    assert taler.codec.name == 'json'
+
+    requests_mock.post('https://merchant.taler.example.com/private/orders', json={'order_id': 'o1'})
+    assert taler.create_order(amount=1, product_description='Café') == {'order_id': 'o1'}
+    assert requests_mock.last_request.json()['order']['summary'] == 'Café'
+
+    requests_mock.get('https://merchant.taler.example.com/private/orders/o1', text='<html>')
+    assert taler.get_order('o1') is None
@@ -0,0 +1,37 @@
+from flask_taler.dedup import MemoryDedupStore, SQLiteDedupStore, event_key
+
+
+def test_memory_dedup_store():
+    now = [0.0]
+    store = MemoryDedupStore(max_size=2, ttl=10, clock=lambda: now[0])
+    assert store.add('a')
+    assert not store.add('a')
+
+    now[0] = 11
+    assert store.add('a')
+
+    store.discard('a')
+    assert store.add('a')
+
+
+def test_memory_dedup_store_is_bounded():
+    store = MemoryDedupStore(max_size=2)
+    for key in 'abc':
+        store.add(key)
+    assert store.add('a')
+    assert not store.add('c')
+
+
+def test_sqlite_dedup_store_is_shared(tmp_path):
+    path = str(tmp_path / 'dedup.sqlite3')
+    first, second = SQLiteDedupStore(path), SQLiteDedupStore(path)
+    assert first.add('a')
+    assert not second.add('a')
+    second.discard('a')
+    assert first.add('a')
+
+
+def test_event_key():
+    assert event_key({'id': 'evt-1', 'type': 'payment.succeeded'}) == 'id:evt-1'
+    assert event_key({'type': 'payment.succeeded', 'payload': {'order_id': 'o1'}}) == 'order:o1:payment.succeeded'
+    assert event_key({'type': 'ping'}) is None
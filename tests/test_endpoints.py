@@ -0,0 +1,28 @@
+import pytest
+
+from flask_taler.endpoints import compile_endpoints
+
+
+@pytest.mark.parametrize('base_url, root', [
+    ('https://merchant.example.com', 'https://merchant.example.com/'),
+    ('https://merchant.example.com/', 'https://merchant.example.com/'),
+    ('https://merchant.example.com/instances/shop', 'https://merchant.example.com/instances/shop/'),
+    ('https://merchant.example.com/instances/shop/', 'https://merchant.example.com/instances/shop/'),
+])
+def test_urls_are_resolved_relative_to_the_backend_url(base_url, root):
+    endpoints = compile_endpoints(base_url, 'key')
+    assert endpoints['create_order'].url() == f'{root}private/orders'
+    assert endpoints['create_order'].url('o1') == f'{root}private/orders'
+    assert endpoints['get_order'].url('o1') == f'{root}private/orders/o1'
+    assert endpoints['process_refund'].url('o1') == f'{root}private/orders/o1/refund'
+
+
+def test_headers_are_shared_and_read_only():
+    endpoints = compile_endpoints('https://merchant.example.com', 'key')
+    assert dict(endpoints['get_order'].headers) == {'Accept': 'application/json', 'Authorization': 'Basic key'}
+    assert endpoints['create_order'].headers['Content-Type'] == 'application/json'
+    assert endpoints['create_order'].headers is endpoints['process_refund'].headers
+    with pytest.raises(TypeError):
+        endpoints['get_order'].headers['Authorization'] = 'Basic other'
+    with pytest.raises(TypeError):
+        endpoints['other'] = None
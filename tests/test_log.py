@@ -0,0 +1,35 @@
+import logging
+import logging.handlers
+import os
+import subprocess
+import sys
+
+from flask import Flask
+
+from flask_taler.log import TruncatedRepr, configure_logging, stop_logging
+
+
+def test_import_does_not_touch_filesystem(tmp_path):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    subprocess.run([sys.executable, '-c', 'import flask_taler'], cwd=tmp_path, env=env, check=True)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_file_sink(tmp_path):
+    app = Flask(__name__)
+    app.config['TALER_LOG_CONSOLE'] = False
+    app.config['TALER_LOG_FILE'] = str(tmp_path / 'taler.log')
+    configure_logging(app)
+
+    logging.getLogger('flask_taler.webhooks').info("Hello from %s", 'a test')
+    stop_logging()
+
+    assert 'Hello from a test' in (tmp_path / 'taler.log').read_text()
+    assert not any(isinstance(handler, logging.handlers.QueueHandler)
+                   for handler in logging.getLogger('flask_taler').handlers)
+
+
+def test_truncated_repr():
+    payload = {'payload': {'items': ['x' * 1000] * 1000}}
+    assert len(str(TruncatedRepr(payload, max_size=100))) == 103
+    assert str(TruncatedRepr({'type': 'ping'})) == "{'type': 'ping'}"
@@ -0,0 +1,23 @@
+from flask_taler.metrics import Metrics
+
+
+def test_render():
+    metrics = Metrics(buckets=(0.1, 1))
+    metrics.begin('get_order')
+    metrics.end('get_order', 0.05, 200)
+    metrics.begin('get_order')
+    metrics.end('get_order', 2, 'error')
+    metrics.begin('get_order')
+    metrics.retry('get_order')
+    metrics.set_gauge('taler_test_gauge', 1, 'A test gauge.')
+
+    lines = metrics.render().splitlines()
+    assert 'taler_backend_request_duration_seconds_bucket{operation="get_order",le="0.1"} 1' in lines
+    assert 'taler_backend_request_duration_seconds_bucket{operation="get_order",le="1"} 1' in lines
+    assert 'taler_backend_request_duration_seconds_bucket{operation="get_order",le="+Inf"} 2' in lines
+    assert 'taler_backend_request_duration_seconds_count{operation="get_order"} 2' in lines
+    assert 'taler_backend_responses_total{operation="get_order",status="200"} 1' in lines
+    assert 'taler_backend_responses_total{operation="get_order",status="error"} 1' in lines
+    assert 'taler_backend_retries_total{operation="get_order"} 1' in lines
+    assert 'taler_backend_requests_in_flight{operation="get_order"} 1' in lines
+    assert 'taler_test_gauge 1' in lines
@@ -0,0 +1,71 @@
+import pytest
+
+from flask_taler import Taler
+
+from conftest import post_webhook
+
+ORDERS_URL = 'https://merchant.taler.example.com/private/orders'
+
+
+@pytest.fixture
+def taler(app):
+    app.config['TALER_WEBHOOK_SECRET'] = 'webhook-secret'
+    app.config['TALER_ORDER_MIRROR'] = 'orders.sqlite3'
+    return Taler(app)
+
+
+def listed(row_id, paid=False):
+    return {'order_id': f'o{row_id}', 'row_id': row_id, 'amount': 'EUR:2', 'summary': 'Mug',
+            'timestamp': {'t_s': 1700000000 + row_id}, 'paid': paid, 'refundable': paid}
+
+
+def test_incremental_sync(taler, requests_mock):
+    requests_mock.get(ORDERS_URL, [
+        {'json': {'orders': [listed(1, paid=True), listed(2), listed(3)]}},
+        {'json': {'orders': [listed(4)]}},
+    ])
+    assert taler.sync_orders(page_size=10) == 3
+    assert taler.order_mirror.cursor == 3
+    assert taler.sync_orders(page_size=10) == 1
+    assert requests_mock.request_history[1].qs['start'] == ['3']
+
+    mirror = taler.order_mirror
+    assert mirror.count() == 4
+    assert mirror.count('paid') == 1
+    assert [order['order_id'] for order in mirror.query(status='unpaid', descending=True)] == ['o4', 'o3', 'o2']
+    assert [order['order_id'] for order in mirror.query(since=1700000002, until=1700000004)] == ['o2', 'o3']
+    order = mirror.get('o1')
+    assert order['amount'] == 'EUR:2'
+    assert order['created_at'] == 1700000001
+    assert order['data'] == listed(1, paid=True)
+    assert not order['stale']
+    assert mirror.get('o5') is None
+
+
+def test_webhooks_mark_orders_for_refresh(taler, requests_mock):
+    requests_mock.get(ORDERS_URL, json={'orders': [listed(1), listed(2)]})
+    taler.sync_orders()
+
+    for event in ({'type': 'payment.succeeded', 'payload': {'order_id': 'o2'}},
+                  {'type': 'order.created', 'payload': {'order_id': 'o9', 'order_status': 'unpaid'}}):
+        with post_webhook(taler.app, event):
+            taler.handle_webhook()
+    assert taler.order_mirror.get('o2')['stale']
+    assert taler.order_mirror.get('o9')['status'] == 'unpaid'
+
+    details = {'order_status': 'paid', 'refunded': False, 'contract_terms': {
+        'order_id': 'o2', 'amount': 'EUR:2', 'summary': 'Mug', 'timestamp': {'t_s': 1700000002}}}
+    requests_mock.get(ORDERS_URL, json={'orders': []})
+    requests_mock.get(f'{ORDERS_URL}/o2', json=details)
+    requests_mock.get(f'{ORDERS_URL}/o9', status_code=404)
+    assert taler.sync_orders() == 1
+
+    order = taler.order_mirror.get('o2')
+    assert (order['status'], order['refunded'], order['stale']) == ('paid', False, False)
+    assert order['data'] == details
+    assert taler.order_mirror.get('o9')['stale']  # Retried at the next sync
+
+
+def test_mirror_is_disabled_by_default(app):
+    with pytest.raises(RuntimeError):
+        Taler(app).sync_orders()
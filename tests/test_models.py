@@ -0,0 +1,74 @@
+import pickle
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+from flask_taler import Amount, Taler
+from flask_taler.models import Order, Refund, WireTransfer
+
+PAID_ORDER = {
+    'order_status': 'paid',
+    'refunded': True,
+    'refund_amount': 'EUR:2',
+    'contract_terms': {
+        'order_id': 'o1',
+        'summary': 'Cool Mug',
+        'amount': 'EUR:10.5',
+        'timestamp': {'t_s': 1700000000},
+    },
+    'refund_details': [
+        {'amount': 'EUR:2', 'reason': 'Damaged', 'timestamp': {'t_s': 1700000100}, 'pending': False},
+    ],
+    'wire_details': [
+        {'wtid': 'W1', 'exchange_url': 'https://exchange.example.com/', 'amount': 'EUR:8.5',
+         'execution_time': {'t_s': 'never'}, 'confirmed': False},
+    ],
+}
+
+
+def test_paid_order():
+    order = Order(PAID_ORDER)
+    assert order['order_status'] == 'paid'
+    assert order == PAID_ORDER
+    assert (order.order_id, order.status, order.paid, order.summary) == ('o1', 'paid', True, 'Cool Mug')
+    assert order.amount == Amount.parse('EUR:10.5')
+    assert order.refund_amount == Amount.parse('EUR:2')
+    assert order.creation_time == datetime(2023, 11, 14, 22, 13, 20, tzinfo=timezone.utc)
+    assert order.refunds == (Refund(Amount.parse('EUR:2'), 'Damaged',
+                                    datetime.fromtimestamp(1700000100, timezone.utc), False),)
+    assert order.wire_details == (WireTransfer('W1', 'https://exchange.example.com/', Amount.parse('EUR:8.5'),
+                                               None, False),)
+    assert order.refunds is order.refunds  # Decoded once
+    with pytest.raises(TypeError):
+        order.contract_terms['summary'] = 'Other'
+    assert pickle.loads(pickle.dumps(order)) == order
+
+
+def test_unpaid_order():
+    order = Order({'order_status': 'unpaid', 'taler_pay_uri': 'taler://pay/x', 'total_amount': 'EUR:3',
+                   'summary': 'Cool Mug', 'creation_time': {'t_s': 1700000000}})
+    assert not order.paid
+    assert order.amount == Amount.parse('EUR:3')
+    assert order.summary == 'Cool Mug'
+    assert order.refund_amount is None
+    assert order.refunds == ()
+    assert order.creation_time.year == 2023
+
+
+def test_orders_are_compact():
+    order = Order(PAID_ORDER)
+    assert not hasattr(order, '__dict__')
+    assert sys.getsizeof(order) < 100
+
+
+def test_get_order_model(app, requests_mock):
+    app.config['TALER_ORDER_CACHE'] = True
+    taler = Taler(app)
+
+    requests_mock.get('https://merchant.taler.example.com/private/orders/o1', json=PAID_ORDER)
+    assert taler.get_order('o1') == PAID_ORDER
+    order = taler.get_order('o1', model=True)  # From the cache
+    assert isinstance(order, Order)
+    assert order.amount == Amount.parse('EUR:10.5')
+    assert requests_mock.call_count == 1
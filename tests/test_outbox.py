@@ -0,0 +1,104 @@
+import time
+
+import pytest
+import requests
+
+from flask_taler import Taler
+from flask_taler.outbox import is_permanent_error
+
+ORDERS_URL = 'https://merchant.taler.example.com/private/orders'
+
+
+def make_taler(app, **config):
+    app.config['TALER_RETRY_BACKOFF'] = 0
+    app.config['TALER_OUTBOX'] = 'outbox.sqlite3'
+    app.config['TALER_OUTBOX_RETRY_BACKOFF'] = 0
+    app.config.update(config)
+    return Taler(app)
+
+
+@pytest.fixture
+def taler(app):
+    return make_taler(app, TALER_OUTBOX_WORKER=False)
+
+
+def test_enqueued_calls_are_retried(taler, requests_mock):
+    requests_mock.post(f'{ORDERS_URL}/o1/refund', [{'status_code': 503}, {'json': {}}])
+    requests_mock.post(ORDERS_URL, [{'exc': requests.exceptions.ConnectTimeout}, {'status_code': 409}])
+
+    taler.enqueue_refund('o1', amount=1.5, reason='Recall')
+    order_id = taler.enqueue_order(amount='3', product_description='Mug')
+    assert len(order_id) == 32
+    assert len(taler.outbox) == 2
+
+    # Refunds are only retried by the outbox, orders with an ID are also retried by the transport,
+    # whose retry gets a 409: the lost response created the order
+    assert taler.outbox.process_batch(taler._send_outbox_entry) == 2
+    assert len(taler.outbox) == 1
+    assert taler.outbox.process_batch(taler._send_outbox_entry) == 1
+    assert len(taler.outbox) == 0
+
+    refund = next(request for request in requests_mock.request_history if request.path.endswith('/refund'))
+    assert refund.json() == {'refund': 'EUR:1.5', 'reason': 'Recall'}
+    create = next(request for request in requests_mock.request_history if request.path.endswith('/orders'))
+    assert create.json()['order']['order_id'] == order_id
+    assert create.json()['order']['amount'] == 'EUR:3'
+
+
+def test_order_created_by_a_lost_attempt(app, requests_mock):
+    taler = make_taler(app, TALER_OUTBOX_WORKER=False, TALER_MAX_RETRIES=0)
+    requests_mock.post(ORDERS_URL, [{'exc': requests.exceptions.ConnectTimeout}, {'status_code': 409}])
+
+    taler.enqueue_order(amount=3)
+    taler.outbox.process_batch(taler._send_outbox_entry)
+    assert len(taler.outbox) == 1
+    taler.outbox.process_batch(taler._send_outbox_entry)
+    assert len(taler.outbox) == 0
+    assert taler.outbox.failed() == []
+
+
+def test_permanent_failures_are_kept(taler, requests_mock):
+    requests_mock.post(f'{ORDERS_URL}/o1/refund', status_code=410)
+    entry_id = taler.enqueue_refund('o1')
+    taler.outbox.process_batch(taler._send_outbox_entry)
+    assert len(taler.outbox) == 0
+
+    [failed] = taler.outbox.failed()
+    assert (failed['id'], failed['operation'], failed['attempts']) == (entry_id, 'process_refund', 1)
+    assert '410' in failed['error']
+
+    requests_mock.post(f'{ORDERS_URL}/o1/refund', json={})
+    assert taler.outbox.retry_failed() == 1
+    taler.outbox.process_batch(taler._send_outbox_entry)
+    assert taler.outbox.failed() == []
+
+
+def test_invalid_calls_are_rejected(taler):
+    with pytest.raises(ValueError):
+        taler.enqueue_refund('o1', amount='one euro')
+    with pytest.raises(TypeError):
+        taler.enqueue_order(amount=1, colour='red')
+    assert len(taler.outbox) == 0
+
+
+def test_is_permanent_error():
+    response = requests.Response()
+    response.status_code = 429
+    assert not is_permanent_error(requests.exceptions.HTTPError(response=response))
+    response.status_code = 404
+    assert is_permanent_error(requests.exceptions.HTTPError(response=response))
+    assert not is_permanent_error(requests.exceptions.ConnectionError())
+    assert is_permanent_error(TypeError())
+
+
+def test_outbox_worker(app, requests_mock):
+    requests_mock.post(f'{ORDERS_URL}/o1/refund', json={})
+    taler = make_taler(app)
+    try:
+        taler.enqueue_refund('o1')
+        deadline = time.monotonic() + 5
+        while requests_mock.call_count == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert requests_mock.call_count == 1
+    finally:
+        taler.outbox.stop()
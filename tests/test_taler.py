@@ -1,6 +1,15 @@
+import asyncio
+import re
+import threading
+import time
+from contextlib import contextmanager
+
 import pytest
-from flask import Flask
-from flask_taler import Taler
+import requests
+from flask import current_app
+from flask_taler import Amount, Taler
+
+from conftest import post_webhook
 
 TALER_MERCHANT_BACKEND_URL = "https://merchant.taler.example.com"
 TALER_EXCHANGE_URL = "https://taler.example.com"
@@ -12,12 +21,13 @@ TALER_MERCHANT_API_KEY = "test_api"
 def mock_taler_backend(requests_mock):
     requests_mock.post(
         'https://merchant.taler.example.com/private/orders',
-        json={'order_id': 'test-order-123', 'payment_redirect_url': 'https://pay.taler.example.com/pay/123'},
+        json={'order_id': 'test-order-123', 'token': 'claim-token',
+              'payment_redirect_url': 'https://pay.taler.example.com/pay/123'},
         status_code=200
     )
     requests_mock.get(
         'https://merchant.taler.example.com/private/orders/test-order-123',
-        json={'payment_redirect_url': 'https://pay.taler.example.com/pay/123'},
+        json={'taler_pay_uri': 'https://pay.taler.example.com/pay/123'},
         status_code=200
     )
     requests_mock.post(
@@ -28,25 +38,352 @@ def mock_taler_backend(requests_mock):
     return requests_mock
 
 
-@pytest.fixture
-def app():
-    app = Flask(__name__)
-    app.config['TESTING'] = True
-    app.config['TALER_EXCHANGE_URL'] = 'https://taler.example.com'
-    app.config['TALER_MERCHANT_BACKEND_URL'] = 'https://merchant.taler.example.com'
-    app.config['TALER_MERCHANT_API_KEY'] = 'test_api_key'
-    return app
+def test_create_order(taler, mock_taler_backend):
+    order = taler.create_order(amount=10.0, product_description="Test Product")
+    assert order['order_id'] == 'test-order-123'
+    assert order['payment_redirect_url'] == 'https://pay.taler.example.com/pay/123'
+    assert mock_taler_backend.last_request.json()['order']['amount'] == 'EUR:10'
+
+
+def test_create_order_with_numeric_string(taler, mock_taler_backend):
+    taler.create_order(amount='10.25')
+    assert mock_taler_backend.last_request.json()['order']['amount'] == 'EUR:10.25'
+    taler.create_order(amount='3', currency='CHF')
+    assert mock_taler_backend.last_request.json()['order']['amount'] == 'CHF:3'
+
+
+def test_amounts_are_exact(taler, mock_taler_backend):
+    taler.create_order(amount=0.1 + 0.2, currency='CHF')
+    assert mock_taler_backend.last_request.json()['order']['amount'] == 'CHF:0.3'
+    taler.create_order(amount=Amount.parse('KUDOS:1.5'))
+    assert mock_taler_backend.last_request.json()['order']['amount'] == 'KUDOS:1.5'
+    taler.process_refund('test-order-123', amount=2.5, reason='Damaged')
+    assert mock_taler_backend.last_request.json() == {'refund': 'EUR:2.5', 'reason': 'Damaged'}
+
+
+def test_webhook_handlers(app, cached_taler):
+    received = []
+    cached_taler.on('payment.succeeded')(received.append)
+    event = {'type': 'payment.succeeded', 'payload': {'order_id': 'test-order-123'}}
+    with post_webhook(app, event):
+        assert cached_taler.handle_webhook()
+    assert received == [event]
+
+
+def test_webhook_payload_log_sampling(app, caplog):
+    app.config['TALER_WEBHOOK_SECRET'] = 'webhook-secret'
+    app.config['TALER_WEBHOOK_LOG_SAMPLE_RATE'] = 0
+    taler = Taler(app)
+    event = {'type': 'payment.succeeded', 'payload': {'order_id': 'test-order-123', 'secret': 'x'}}
+    with caplog.at_level('INFO', logger='flask_taler'), post_webhook(app, event):
+        taler.handle_webhook()
+
+    record = next(record for record in caplog.records if record.getMessage().startswith('Received'))
+    assert record.getMessage() == 'Received Taler webhook payment.succeeded for order test-order-123'
+    assert record.taler_order_id == 'test-order-123'
+
+
+def test_webhook_dedup(app):
+    app.config['TALER_WEBHOOK_SECRET'] = 'webhook-secret'
+    app.config['TALER_WEBHOOK_DEDUP'] = True
+    taler = Taler(app)
+    received = []
+    taler.on('payment.succeeded')(received.append)
+
+    event = {'type': 'payment.succeeded', 'payload': {'order_id': 'test-order-123'}}
+    for delivery in (event, event, dict(event, delivered_at=1)):
+        with post_webhook(app, delivery):
+            assert taler.handle_webhook()
+    assert received == [event]
+
+
+def test_webhook_dedup_allows_retry_after_failure(app):
+    app.config['TALER_WEBHOOK_SECRET'] = 'webhook-secret'
+    app.config['TALER_WEBHOOK_DEDUP'] = True
+    taler = Taler(app)
+    attempts = []
+
+    @taler.on('payment.succeeded')
+    def flaky(event):
+        attempts.append(event)
+        if len(attempts) == 1:
+            raise RuntimeError('temporary failure')
+
+    event = {'type': 'payment.succeeded', 'payload': {'order_id': 'test-order-123'}}
+    with post_webhook(app, event), pytest.raises(RuntimeError):
+        taler.handle_webhook()
+    with post_webhook(app, event):
+        assert taler.handle_webhook()
+    assert len(attempts) == 2
+
+
+def test_async_webhook(app, monkeypatch):
+    app.config['TALER_WEBHOOK_SECRET'] = 'webhook-secret'
+    app.config['TALER_WEBHOOK_ASYNC'] = True
+    taler = Taler(app)
+    processed = threading.Event()
+    events = []
+
+    def process_event(event):
+        events.append(event)
+        processed.set()
+
+    monkeypatch.setattr(taler, '_process_event', process_event)
+    event = {'type': 'payment.succeeded', 'payload': {'order_id': 'test-order-123'}}
+    with post_webhook(app, event):
+        assert taler.handle_webhook()
+
+    assert processed.wait(5)
+    taler.webhook_workers.stop()
+    assert events == [event]
+
+
+def test_async_webhook_handlers_run_in_app_context(app):
+    app.config['TALER_WEBHOOK_SECRET'] = 'webhook-secret'
+    app.config['TALER_WEBHOOK_ASYNC'] = True
+    taler = Taler(app)
+    processed = threading.Event()
+    apps = []
+
+    @taler.on('payment.succeeded')
+    def handler(event):
+        apps.append(current_app._get_current_object())
+        processed.set()
+
+    event = {'type': 'payment.succeeded', 'payload': {'order_id': 'test-order-123'}}
+    with post_webhook(app, event):
+        assert taler.handle_webhook()
+
+    assert processed.wait(5)
+    taler.webhook_workers.stop()
+    assert apps == [app]
+
+
+@pytest.mark.parametrize('queued', [False, True])
+def test_parallel_webhook_handlers_run_in_app_context(app, queued):
+    app.config['TALER_WEBHOOK_SECRET'] = 'webhook-secret'
+    app.config['TALER_WEBHOOK_PARALLEL_HANDLERS'] = True
+    app.config['TALER_WEBHOOK_ASYNC'] = queued
+    taler = Taler(app)
+    apps = []
+    done = threading.Semaphore(0)
+
+    @taler.on('payment.succeeded')
+    def first(event):
+        apps.append(current_app._get_current_object())
+        done.release()
+
+    @taler.on('payment.succeeded')
+    def second(event):
+        apps.append(current_app._get_current_object())
+        done.release()
+
+    with post_webhook(app, {'type': 'payment.succeeded', 'payload': {'order_id': 'test-order-123'}}):
+        assert taler.handle_webhook()
+
+    assert done.acquire(timeout=5) and done.acquire(timeout=5)
+    if queued:
+        taler.webhook_workers.stop()
+    assert apps == [app, app]
+
+
+def test_metrics_endpoint(app, mock_taler_backend):
+    app.config['TALER_METRICS_URL'] = '/metrics'
+    taler = Taler(app)
+    mock_taler_backend.get('https://merchant.taler.example.com/private/orders/missing-order', status_code=404)
+    taler.create_order(amount=10.0)
+    taler.get_order('missing-order')
+
+    response = app.test_client().get('/metrics')
+    assert response.status_code == 200
+    assert 'taler_backend_responses_total{operation="create_order",status="200"} 1' in response.text
+    assert 'taler_backend_responses_total{operation="get_order",status="404"} 1' in response.text
+
+
+class FakeSpan(dict):
+    def set_attribute(self, key, value):
+        self[key] = value
+
+
+class FakeTracer(object):
+    enabled = True
+
+    def __init__(self):
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, attributes=None, kind='client'):
+        span = FakeSpan(attributes or {}, name=name, kind=kind)
+        self.spans.append(span)
+        yield span
+
+    def inject(self, headers):
+        headers['traceparent'] = '00-trace-span-01'
+
+
+def test_tracing_hooks(app, mock_taler_backend):
+    tracer = FakeTracer()
+    app.config['TALER_TRACER'] = tracer
+    app.config['TALER_WEBHOOK_SECRET'] = 'webhook-secret'
+    taler = Taler(app)
+
+    taler.process_refund('test-order-123')
+    with post_webhook(app, {'type': 'payment.succeeded', 'payload': {'order_id': 'test-order-123'}}):
+        taler.handle_webhook()
+
+    assert mock_taler_backend.last_request.headers['traceparent'] == '00-trace-span-01'
+    refund_span, webhook_span = tracer.spans
+    assert refund_span['name'] == 'taler.process_refund'
+    assert refund_span['kind'] == 'client'
+    assert refund_span['taler.order_id'] == 'test-order-123'
+    assert refund_span['http.response.status_code'] == 200
+    assert webhook_span['name'] == 'taler.webhook'
+    assert webhook_span['kind'] == 'internal'
+    assert webhook_span['taler.handlers'] == 0
+
+
+def test_create_orders(taler, mock_taler_backend):
+    mock_taler_backend.post(
+        'https://merchant.taler.example.com/private/orders',
+        [{'json': {'order_id': 'test-order-123'}}, {'status_code': 500}, {'json': {'order_id': 'test-order-123'}}],
+    )
+    specs = ({'amount': amount} for amount in (1, 2, 3))
+    results = sorted(taler.create_orders(specs, concurrency=2))
+
+    assert [result.index for result in results] == [0, 1, 2]
+    assert sum(result.ok for result in results) == 2
+    failed = next(result for result in results if not result.ok)
+    assert failed.result is None
+    assert failed.error.response.status_code == 500
+
+
+def test_get_orders(cached_taler, requests_mock):
+    def order(request, context):
+        order_id = request.path.rsplit('/', 1)[-1]
+        if order_id == 'missing':
+            context.status_code = 404
+            return {}
+        return {'order_status': 'paid', 'contract_terms': {'order_id': order_id}}
+
+    requests_mock.get(re.compile('https://merchant.taler.example.com/private/orders/'), json=order)
+    cached_taler.order_cache.set('cached', {'order_status': 'paid'})
+    orders = cached_taler.get_orders(['o1', 'o2', 'missing', 'o1', 'cached', 'o3'], concurrency=4)
+
+    assert list(orders) == ['o1', 'o2', 'missing', 'cached', 'o3']
+    assert orders['o2'] == {'order_status': 'paid', 'contract_terms': {'order_id': 'o2'}}
+    assert orders['missing'] is None
+    assert orders['cached'] == {'order_status': 'paid'}
+    assert requests_mock.call_count == 4
+
+    orders = cached_taler.get_orders(['o1', 'cached'], model=True)
+    assert orders['o1'].order_id == 'o1' and orders['cached'].paid
+    assert requests_mock.call_count == 4
+    stats = cached_taler.order_cache.stats()
+    assert (stats['hits'], stats['misses']) == (3, 4)  # Each lookup is counted once
 
 
 @pytest.fixture
-def taler(app):
-    return Taler(app)
+def order_list_backend(requests_mock):
+    orders = [{'order_id': f'o{row_id}', 'row_id': row_id, 'amount': 'EUR:1.5', 'paid': row_id % 2 == 0}
+              for row_id in range(1, 26)]
 
+    def list_orders(request, context):
+        delta = int(request.qs['delta'][0])
+        rows = [order for order in orders if request.qs.get('paid', ['yes'])[0] == 'yes' or not order['paid']]
+        if delta > 0:
+            start = int(request.qs.get('start', [0])[0])
+            rows = [order for order in rows if order['row_id'] > start][:delta]
+        else:
+            start = int(request.qs.get('start', [2 ** 63 - 1])[0])
+            rows = [order for order in reversed(rows) if order['row_id'] < start][:-delta]
+        return {'orders': rows}
 
-def test_create_order(taler, mock_taler_backend):
-    order = taler.create_order(amount=10.0, product_description="Test Product")
-    assert order['order_id'] == 'test-order-123'
-    assert order['payment_redirect_url'] == 'https://pay.taler.example.com/pay/123'
+    requests_mock.get('https://merchant.taler.example.com/private/orders', json=list_orders)
+    return requests_mock
+
+
+@pytest.mark.parametrize('prefetch', [False, True])
+def test_iter_orders(taler, order_list_backend, prefetch):
+    orders = list(taler.iter_orders(page_size=10, prefetch=prefetch))
+    assert [order['row_id'] for order in orders] == list(range(1, 26))
+    assert order_list_backend.call_count == 3
+    assert Amount.sum(order['amount'] for order in orders) == Amount.parse('EUR:37.5')
+
+    orders = list(taler.iter_orders(descending=True, start=20, page_size=5, model=True))
+    assert [order.order_id for order in orders] == [f'o{row_id}' for row_id in range(19, 0, -1)]
+
+
+def test_iter_orders_is_lazy(taler, order_list_backend):
+    orders = taler.iter_orders(paid=False, page_size=5, prefetch=True)
+    assert next(orders)['order_id'] == 'o1'
+    assert order_list_backend.call_count <= 2
+    assert order_list_backend.request_history[0].qs['paid'] == ['no']
+    orders.close()
+
+
+def test_iter_orders_raises_errors(taler, requests_mock):
+    requests_mock.get('https://merchant.taler.example.com/private/orders', status_code=403)
+    with pytest.raises(requests.exceptions.HTTPError):
+        next(taler.iter_orders())
+
+
+def test_concurrent_get_order_is_coalesced(taler, mock_taler_backend):
+    def slow_response(request, context):
+        time.sleep(0.1)
+        return {'order_status': 'paid'}
+
+    mock_taler_backend.get('https://merchant.taler.example.com/private/orders/test-order-123', json=slow_response)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(taler.get_order('test-order-123')))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [{'order_status': 'paid'}] * 5
+    assert mock_taler_backend.call_count == 1
+
+
+def test_wait_for_payment(taler, mock_taler_backend):
+    mock_taler_backend.get(
+        'https://merchant.taler.example.com/private/orders/test-order-123',
+        [{'json': {'order_status': 'claimed'}}, {'json': {'order_status': 'paid'}}],
+    )
+    order = taler.wait_for_payment('test-order-123', timeout=5, min_interval=0)
+
+    assert order['order_status'] == 'paid'
+    assert mock_taler_backend.call_count == 2
+    assert 0 < int(mock_taler_backend.last_request.qs['timeout_ms'][0]) <= 5000
+
+
+def test_wait_for_payment_timeout(taler, mock_taler_backend):
+    mock_taler_backend.get('https://merchant.taler.example.com/private/orders/test-order-123',
+                           json={'order_status': 'unpaid'})
+    order = taler.wait_for_payment('test-order-123', timeout=0.2, min_interval=0.1)
+
+    assert order['order_status'] == 'unpaid'
+    assert 2 <= mock_taler_backend.call_count <= 3
+
+
+def test_create_checkout(taler, mock_taler_backend):
+    order_id, payment_url = taler.create_checkout(amount=10.0, product_description="Test Product")
+    assert order_id == 'test-order-123'
+    assert payment_url == 'taler://pay/merchant.taler.example.com/test-order-123/?c=claim-token'
+    assert [request.method for request in mock_taler_backend.request_history] == ['POST']
+
+
+@pytest.mark.parametrize('backend_url', ['http://localhost:9966/instances/shop', 'http://localhost:9966/instances/shop/'])
+def test_pay_uri_with_instance_path(app, requests_mock, backend_url):
+    app.config['TALER_MERCHANT_BACKEND_URL'] = backend_url
+    taler = Taler(app)
+    requests_mock.post('http://localhost:9966/instances/shop/private/orders',
+                       json={'order_id': 'order 1', 'token': 'claim-token'})
+
+    order_id, payment_url = taler.create_checkout(amount=10)
+    assert order_id == 'order 1'
+    assert payment_url == 'taler+http://pay/localhost:9966/instances/shop/order%201/?c=claim-token'
+    assert taler._pay_uri('order 1', session_id='s1') == 'taler+http://pay/localhost:9966/instances/shop/order%201/s1'
 
 
 def test_get_payment_url(taler, mock_taler_backend):
@@ -57,3 +394,153 @@ def test_get_payment_url(taler, mock_taler_backend):
 def test_process_refund(taler, mock_taler_backend):
     refund = taler.process_refund('test-order-123')
     assert refund['refund_id'] == 'refund-456'
+
+
+def test_process_refunds_can_resume(taler, requests_mock, tmp_path):
+    for order_id in ('o1', 'o2', 'o3'):
+        requests_mock.post(f'https://merchant.taler.example.com/private/orders/{order_id}/refund',
+                           json={'taler_refund_uri': f'taler://refund/{order_id}'})
+    requests_mock.post('https://merchant.taler.example.com/private/orders/o4/refund',
+                       [{'status_code': 500}, {'json': {'taler_refund_uri': 'taler://refund/o4'}}])
+    refunds = ['o1', {'order_id': 'o2', 'amount': 'EUR:1', 'reason': 'Recall'}, 'o3', 'o4']
+    checkpoint = str(tmp_path / 'refunds.log')
+
+    results = sorted(taler.process_refunds(refunds, concurrency=2, rate=1000, checkpoint=checkpoint))
+    assert [result.ok for result in results] == [True, True, True, False]
+    assert results[1].result == {'taler_refund_uri': 'taler://refund/o2'}
+    assert requests_mock.call_count == 4
+
+    results = sorted(taler.process_refunds(refunds, checkpoint=checkpoint))
+    assert all(result.ok for result in results)
+    assert [result.result for result in results[:3]] == [None, None, None]  # Done by the first run
+    assert requests_mock.call_count == 5
+    assert requests_mock.last_request.path == '/private/orders/o4/refund'
+
+
+@pytest.fixture
+def cached_taler(app):
+    app.config['TALER_ORDER_CACHE'] = True
+    app.config['TALER_WEBHOOK_SECRET'] = 'webhook-secret'
+    return Taler(app)
+
+
+def test_order_cache(cached_taler, mock_taler_backend):
+    assert cached_taler.get_order('test-order-123') == cached_taler.get_order('test-order-123')
+    assert cached_taler.get_payment_url('test-order-123') == 'https://pay.taler.example.com/pay/123'
+    assert mock_taler_backend.call_count == 1
+    assert cached_taler.order_cache.stats() == {'hits': 2, 'misses': 1, 'size': 1}
+
+
+def test_order_cache_invalidation(app, cached_taler, mock_taler_backend):
+    cached_taler.get_order('test-order-123')
+    with post_webhook(app, {'type': 'payment.succeeded', 'payload': {'order_id': 'test-order-123'}}):
+        assert cached_taler.handle_webhook()
+    cached_taler.get_order('test-order-123')
+    cached_taler.process_refund('test-order-123')
+    cached_taler.get_order('test-order-123')
+
+    assert [request.method for request in mock_taler_backend.request_history] == ['GET', 'GET', 'POST', 'GET']
+
+
+def test_transport_pool_config(app):
+    app.config['TALER_HTTP_POOL_SIZE'] = 4
+    app.config['TALER_HTTP_POOL_BLOCK'] = True
+    taler = Taler(app)
+    assert taler.transport.adapter._pool_maxsize == 4
+    assert taler.transport.adapter._pool_block is True
+
+
+def test_transport_shares_pool_across_threads(taler, mock_taler_backend):
+    sessions = []
+
+    def worker():
+        taler.get_order('test-order-123')
+        sessions.append(taler.transport.session)
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(session) for session in sessions}) == 3
+    assert all(session.get_adapter('https://x') is taler.transport.adapter for session in sessions)
+
+
+@pytest.fixture
+def async_backend(taler):
+    httpx = pytest.importorskip('httpx')
+    requests_seen = []
+
+    def handler(request):
+        requests_seen.append(request)
+        if request.url.path == '/private/orders':
+            return httpx.Response(200, json={'order_id': 'test-order-123', 'token': 'abc'})
+        if request.url.path == '/private/orders/test-order-123':
+            return httpx.Response(200, json={'taler_pay_uri': 'taler://pay/merchant/test-order-123/'})
+        if request.url.path == '/private/orders/test-order-123/refund':
+            return httpx.Response(200, json={'refund_id': 'refund-456'})
+        return httpx.Response(404, json={'code': 2000})
+
+    taler.transport._async_client_options['transport'] = httpx.MockTransport(handler)
+    return requests_seen
+
+
+def test_async_api(taler, async_backend):
+    async def checkout():
+        order = await taler.acreate_order(amount=10.0, product_description="Test Product")
+        payment_url = await taler.aget_payment_url(order['order_id'])
+        refund = await taler.aprocess_refund(order['order_id'])
+        missing = await taler.aget_order('missing')
+        return order, payment_url, refund, missing
+
+    order, payment_url, refund, missing = asyncio.run(checkout())
+    assert order['order_id'] == 'test-order-123'
+    assert payment_url == 'taler://pay/merchant/test-order-123/'
+    assert refund['refund_id'] == 'refund-456'
+    assert missing is None
+    assert async_backend[0].headers['Authorization'] == 'Basic test_api_key'
+
+
+def test_async_client_per_event_loop(taler, async_backend):
+    async def get_client():
+        await taler.aget_order('test-order-123')
+        return await taler.transport.async_client()
+
+    async def get_clients_twice():
+        return await get_client(), await get_client()
+
+    first, same = asyncio.run(get_clients_twice())
+    other = asyncio.run(get_client())
+    assert first is same
+    assert first is not other
+
+
+def test_async_clients_are_closed_with_their_loop(taler, async_backend):
+    clients = [asyncio.run(taler.transport.async_client()) for _ in range(5)]
+    assert taler.transport._async_clients == {}
+    assert all(client.is_closed for client in clients)
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(taler.transport.async_client())
+    loop.close()  # Without shutting down async generators
+    asyncio.run(taler.aget_order('test-order-123'))
+    assert taler.transport._async_clients == {}
+
+
+def test_async_get_order_is_coalesced(taler):
+    httpx = pytest.importorskip('httpx')
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={'order_status': 'paid'})
+
+    taler.transport._async_client_options['transport'] = httpx.MockTransport(handler)
+
+    async def lookups():
+        return await asyncio.gather(*(taler.aget_order('test-order-123') for _ in range(5)))
+
+    assert asyncio.run(lookups()) == [{'order_status': 'paid'}] * 5
+    assert len(calls) == 1
@@ -0,0 +1,147 @@
+import pytest
+import requests
+from flask_taler import Taler
+from flask_taler.transport import CircuitBreaker, CircuitOpenError, RetryBudget
+
+ORDERS_URL = 'https://merchant.taler.example.com/private/orders'
+
+
+@pytest.fixture
+def taler(app):
+    app.config['TALER_RETRY_BACKOFF'] = 0
+    app.config['TALER_TIMEOUTS'] = {'get_order': (1, 5)}
+    return Taler(app)
+
+
+def test_get_order_is_retried(taler, requests_mock):
+    requests_mock.get(f'{ORDERS_URL}/o1', [
+        {'status_code': 503},
+        {'exc': requests.exceptions.ConnectTimeout},
+        {'json': {'order_status': 'paid'}},
+    ])
+    assert taler.get_order('o1') == {'order_status': 'paid'}
+    assert requests_mock.call_count == 3
+    assert requests_mock.last_request.timeout == (1, 5)
+    assert 'taler_backend_retries_total{operation="get_order"} 2' in taler.metrics.render()
+
+
+def test_retries_are_bounded(taler, requests_mock):
+    requests_mock.get(f'{ORDERS_URL}/o1', status_code=503)
+    assert taler.get_order('o1') is None
+    assert requests_mock.call_count == 3
+
+
+def test_create_order_is_only_retried_with_an_order_id(taler, requests_mock):
+    requests_mock.post(ORDERS_URL, [{'status_code': 503}, {'json': {'order_id': 'o1'}}])
+    with pytest.raises(requests.exceptions.HTTPError):
+        taler.create_order(amount=1)
+
+    requests_mock.post(ORDERS_URL, [{'status_code': 503}, {'json': {'order_id': 'o1'}}])
+    assert taler.create_order(amount=1, order_id='o1') == {'order_id': 'o1'}
+    assert requests_mock.last_request.timeout == (3.05, 30)
+
+
+def test_create_order_retried_after_a_lost_response(taler, requests_mock):
+    # The backend created the order, but the response was lost: the retry is rejected as a duplicate
+    requests_mock.post(ORDERS_URL, [{'exc': requests.exceptions.ConnectionError}, {'status_code': 409}])
+    requests_mock.get(f'{ORDERS_URL}/o1', json={'order_status': 'unpaid', 'taler_pay_uri': 'taler://pay/o1'})
+    assert taler.create_order(amount=1, order_id='o1') == {'order_id': 'o1'}
+
+    requests_mock.post(ORDERS_URL, [{'exc': requests.exceptions.ConnectionError}, {'status_code': 409}])
+    assert taler.create_checkout(amount=1, order_id='o1') == ('o1', 'taler://pay/o1')
+
+    # Without a retry, the order ID was already taken by another order
+    requests_mock.post(ORDERS_URL, status_code=409)
+    with pytest.raises(requests.exceptions.HTTPError):
+        taler.create_order(amount=1, order_id='o1')
+
+
+def test_long_poll_read_timeout_includes_polling_time(taler, requests_mock):
+    requests_mock.get(f'{ORDERS_URL}/o1', json={'order_status': 'paid'})
+    taler.wait_for_payment('o1', timeout=10)
+    connect, read = requests_mock.last_request.timeout
+    assert connect == 3.05
+    assert 39 < read <= 40
+
+
+def test_retry_budget():
+    now = [0.0]
+    budget = RetryBudget(ratio=0.5, min_per_second=0, max_tokens=1, clock=lambda: now[0])
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+
+    budget = RetryBudget(ratio=0, min_per_second=1, max_tokens=2, clock=lambda: now[0])
+    assert budget.withdraw()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    now[0] = 1
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+
+def test_circuit_breaker():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_rate=0.5, window=4, min_calls=4, reset_timeout=10, clock=lambda: now[0])
+    for failed in (False, True, False):
+        token = breaker.allow()
+        assert token is not None
+        breaker.record(token, failed)
+    assert breaker.state == 'closed'
+    breaker.record(breaker.allow(), True)
+    assert breaker.state == 'open'
+    assert breaker.allow() is None
+
+    now[0] = 10
+    probe = breaker.allow()
+    assert probe is not None
+    assert breaker.state == 'half_open'
+    assert breaker.allow() is None  # A single probe at a time
+    breaker.record(probe, True)
+    assert breaker.state == 'open'
+
+    now[0] = 20
+    breaker.record(breaker.allow(), False)
+    assert breaker.state == 'closed'
+    assert breaker.state_value() == 0
+
+
+def test_circuit_breaker_ignores_calls_allowed_before_a_state_change():
+    now = [0.0]
+    breaker = CircuitBreaker(window=2, min_calls=2, reset_timeout=10, clock=lambda: now[0])
+    slow_call = breaker.allow()
+    breaker.record(breaker.allow(), True)
+    breaker.record(breaker.allow(), True)
+    assert breaker.state == 'open'
+
+    now[0] = 10
+    probe = breaker.allow()
+    breaker.record(slow_call, False)  # Not the outcome of the probe
+    assert breaker.state == 'half_open'
+    assert breaker.allow() is None
+    breaker.record(probe, False)
+    assert breaker.state == 'closed'
+
+
+def test_circuit_breaker_trips_on_slow_calls():
+    breaker = CircuitBreaker(slow_call_duration=1, slow_call_rate=0.5, window=2, min_calls=2)
+    breaker.record(breaker.allow(), False, 0.5)
+    breaker.record(breaker.allow(), False, 2)
+    assert breaker.state == 'open'
+
+
+def test_open_circuit_fails_fast(taler, requests_mock):
+    taler.app.config['TALER_MAX_RETRIES'] = 0
+    taler.init_app(taler.app)
+    requests_mock.get(f'{ORDERS_URL}/o1', status_code=503)
+    for _ in range(10):
+        assert taler.get_order('o1') is None
+    assert requests_mock.call_count == 10
+    assert 'taler_circuit_breaker_state 2' in taler.metrics.render()
+
+    with pytest.raises(CircuitOpenError):
+        taler.create_order(amount=1)
+    assert requests_mock.call_count == 10
@@ -0,0 +1,104 @@
+import queue
+import threading
+
+import pytest
+
+from flask_taler.webhooks import HandlerRegistry, MemoryQueue, SQLiteQueue
+
+
+def test_memory_queue_is_bounded():
+    webhook_queue = MemoryQueue(max_size=1)
+    webhook_queue.put(b'1')
+    with pytest.raises(queue.Full):
+        webhook_queue.put(b'2')
+    assert webhook_queue.get(timeout=0)[1] == b'1'
+    assert webhook_queue.get(timeout=0) is None
+
+
+def test_sqlite_queue(tmp_path):
+    webhook_queue = SQLiteQueue(str(tmp_path / 'queue.sqlite3'), max_size=2, max_attempts=2, retry_backoff=0)
+    webhook_queue.put(b'first')
+    webhook_queue.put(b'second')
+    with pytest.raises(queue.Full):
+        webhook_queue.put(b'third')
+
+    item_id, payload = webhook_queue.get(timeout=0)
+    assert payload == b'first'
+    webhook_queue.ack(item_id)
+
+    # A failed item is retried, then dropped after max_attempts
+    for _ in range(2):
+        item_id, payload = webhook_queue.get(timeout=0)
+        assert payload == b'second'
+        webhook_queue.fail(item_id)
+    assert webhook_queue.get(timeout=0) is None
+    assert len(webhook_queue) == 0
+
+
+def test_sqlite_queue_retries_after_a_backoff(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('flask_taler.webhooks.time.time', lambda: now[0])
+    webhook_queue = SQLiteQueue(str(tmp_path / 'queue.sqlite3'), retry_backoff=10)
+    webhook_queue.put(b'payload')
+
+    item_id, _ = webhook_queue.get(timeout=0)
+    webhook_queue.fail(item_id)
+    assert webhook_queue.get(timeout=0) is None
+    assert len(webhook_queue) == 1
+    now[0] += 10
+    assert webhook_queue.get(timeout=0) == (item_id, b'payload')
+
+
+def test_sqlite_queue_timed_out_items_respect_max_attempts(tmp_path):
+    webhook_queue = SQLiteQueue(str(tmp_path / 'queue.sqlite3'), max_attempts=2, visibility_timeout=-1)
+    webhook_queue.put(b'payload')
+
+    # Items which are never acknowledged (e.g. the worker died) are reclaimed until max_attempts
+    for _ in range(2):
+        assert webhook_queue.get(timeout=0)[1] == b'payload'
+    assert webhook_queue.get(timeout=0) is None
+    assert len(webhook_queue) == 0
+
+
+def test_sqlite_queue_is_durable(tmp_path):
+    path = str(tmp_path / 'queue.sqlite3')
+    SQLiteQueue(path).put(b'payload')
+    assert SQLiteQueue(path).get(timeout=0)[1] == b'payload'
+
+
+def test_handler_registry_dispatch():
+    registry = HandlerRegistry()
+    calls = []
+    registry.register('payment.succeeded', lambda event: calls.append('first'))
+    registry.register('payment.succeeded', lambda event: calls.append('second'))
+    registry.register('*', lambda event: calls.append('all'))
+
+    assert registry.dispatch({'type': 'payment.succeeded'}) == 3
+    assert registry.dispatch({'type': 'refund'}) == 1
+    assert calls == ['first', 'second', 'all', 'all']
+
+
+def test_handler_registry_errors_and_stats():
+    registry = HandlerRegistry(slow_threshold=0)
+    calls = []
+
+    def failing(event):
+        raise ValueError('boom')
+
+    registry.register('payment.succeeded', failing)
+    registry.register('payment.succeeded', calls.append)
+    with pytest.raises(ValueError):
+        registry.dispatch({'type': 'payment.succeeded'})
+
+    assert len(calls) == 1
+    stats = registry.stats()
+    assert stats['test_webhooks.test_handler_registry_errors_and_stats.<locals>.failing']['errors'] == 1
+    assert sum(handler['calls'] for handler in stats.values()) == 2
+
+
+def test_handler_registry_parallel():
+    registry = HandlerRegistry(parallel=True)
+    barrier = threading.Barrier(2, timeout=5)
+    registry.register('payment.succeeded', lambda event: barrier.wait())
+    registry.register('payment.succeeded', lambda event: barrier.wait())
+    assert registry.dispatch({'type': 'payment.succeeded'}) == 2